@@ -1,4 +1,6 @@
 class Comment:
+    __slots__ = ("comment", "prefix")
+
     def __init__(self, comment: str, prefix: str = ""):
         self.comment = comment.strip()
         self.prefix = prefix
@@ -20,12 +22,18 @@ class Comment:
 
 
 class QuotedComment(Comment):
+    __slots__ = ("quote", "start_index", "length")
+
     def __init__(self, comment, quote, start_index, length):
         super().__init__(comment)
         self.quote = quote
         self.start_index = start_index
         self.length = length
 
+    @property
+    def end_index(self):
+        return self.start_index + self.length
+
     def __str__(self):
         return f'"{self.quote}" - {self.comment}'
 
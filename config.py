@@ -1,3 +1,5 @@
+import os
+
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,15 +13,135 @@ config = {
         "document_link_column": "D",
         "reported_gpa_column": "L",
         "middle_school_column": "K",
+        "lease_column": "",  # an unused column, needed for worker leases with --lease-backend sheet
         "row_start": 2,
+        "fetch_chunk_size": 500,  # rows per values().get page
+        "cursor_path": ".cache/sheet_cursor.json",  # first row that may still need processing
         "sps_start_indicator": "SPS:",
         "pse_start_indicator": "PSE:",
+        "write_behind": {
+            "flush_size": 50,  # cell updates per batchUpdate
+            "flush_interval": 10,  # seconds an update may wait in the buffer
+            "max_attempts": 5,
+            "retry_delay": 1,  # seconds, the base of the jittered exponential backoff
+            "max_retry_delay": 30,
+        },
+    },
+    "ai_service": {
+        # point this at scripts/stub_openai_server.py to run without the real API
+        "base_url": os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        "connection_limit": 100,
+        "connection_limit_per_host": 32,
+        "dns_cache_ttl": 300,  # seconds
+        "keepalive_timeout": 30,  # seconds an idle connection stays in the pool
+        "connect_timeout": 10,
+        "read_timeout": 120,
+        "total_timeout": 300,
+        "retry": {
+            "max_attempts": 6,
+            "base_delay": 1,  # seconds, doubled on every attempt before jitter
+            "max_delay": 60,
+            "deadline": 300,  # seconds across all attempts of one completion
+        },
+        "cache": {
+            "enabled": True,
+            "path": ".cache/completions.sqlite3",
+            "ttl": 30 * 24 * 60 * 60,  # seconds
+            "max_entries": 50000,
+        },
+        "circuit_breaker": {
+            "window": 20,  # most recent calls considered per model
+            "failure_threshold": 0.5,
+            "min_calls": 5,
+            "cooldown": 30,  # seconds before a probe call is let through
+        },
     },
     "folder_id": "1jeEq39T2Devm1nhZghmaCAbGumBjZgWS",  # this is the folder where the generated documents will be stored
+    "drive": {
+        "resumable_threshold": 5 * 1024 * 1024,  # bytes; smaller uploads use a single request
+        "max_upload_workers": 4,
+    },
     "generated_document_name": "Self-Paced Feedback Set #1",
+    "firestore": {
+        "batch_size": 500,  # writes per commit; Firestore allows at most 500
+        "flush_interval": 1.0,  # seconds to wait for more writes before committing a partial batch
+        "max_concurrent_commits": 4,
+        "max_attempts": 5,
+        "retry_delay": 1,  # seconds, the base of the jittered exponential backoff
+        "max_retry_delay": 30,
+        "emulator_project_id": "demo-gpt-comment",  # used when FIRESTORE_EMULATOR_HOST is set
+    },
+    "report": {
+        "template_path": "data/report_template.docx",  # rebuild with scripts/build_report_template.py
+        "render_workers": 2,  # processes rendering reports in parallel
+    },
     "limit": 1,
-    "contractions_data_path": "data/contractions.json",
-    "second_person_data_path": "data/second_person.json",
+    "pipeline": {
+        "max_in_flight": 8,  # submissions held between analysis and marking the sheet
+        "queue_size": 4,  # capacity of the queue in front of each stage
+        "upload_workers": 4,
+    },
+    # long-running mode (python daemon.py); see daemon.py
+    "daemon": {
+        "poll_interval": 15,  # seconds between checks of the spreadsheet's Drive version
+        "queue_size": 32,  # new submissions waiting to enter the pipeline
+    },
+    # row leases for worker mode (main.py --worker-id); see leases.py
+    "leases": {
+        "ttl": 15 * 60,  # seconds a lease lasts unless it is renewed
+        "heartbeat_interval": 60,  # seconds between renewals of the leases a worker holds
+        "path": ".cache/leases.sqlite3",  # for --lease-backend sqlite, shared by the workers on one host
+        "settle_delay": 3,  # seconds to wait for competing claims with --lease-backend sheet
+    },
+    # stage checkpoints, so a crashed run resumes submissions where they stopped; see journal.py
+    "journal": {
+        "enabled": True,
+        "path": ".cache/journal.sqlite3",
+        "retention": 24 * 60 * 60,  # seconds to keep entries once their row is marked completed
+        "stale_after": 30 * 24 * 60 * 60,  # seconds before unfinished entries are dropped
+    },
+    # run report (spans, latency histograms, token and cost counters) written at the end of every run
+    "metrics": {
+        "report_path": ".cache/run_report.json",
+        "prometheus_path": ".cache/metrics.prom",  # for the node_exporter textfile collector
+        "prefix": "gpt_comment",
+        "max_spans": 50000,
+    },
+    # models per kind of request, cheapest first; see services/model_router.py.
+    # A reply escalates to the next model when fewer than min_parsed_ratio of the
+    # expected "quote" - suggestion lines parse, or fewer than min_anchor_rate of
+    # the parsed quotes are found in the essay. A quote is found when a match
+    # covers at least min_match_ratio of it.
+    "routing": {
+        "sps_specific": {
+            "models": ["gpt-3.5-turbo", "gpt-4"],
+            "min_parsed_ratio": 0.6,
+            "min_anchor_rate": 0.7,
+            "min_match_ratio": 0.6,
+        },
+        "pse_specific": {
+            "models": ["gpt-3.5-turbo", "gpt-4"],
+            "min_parsed_ratio": 0.6,
+            "min_anchor_rate": 0.7,
+            "min_match_ratio": 0.6,
+        },
+        "grammar": {"models": ["gpt-3.5-turbo"]},
+        "sps_general": {"models": ["gpt-3.5-turbo"]},
+        "pse_general": {"models": ["gpt-3.5-turbo"]},
+    },
+    # grouping paragraphs into as few requests as possible; see packing.py
+    "packing": {
+        "max_prompt_tokens": 1500,  # paragraph tokens per request, labels included
+        "comment_tokens": 80,  # max_tokens allowed per expected comment
+        "grammar_tokens_per_comment": 48,  # one expected grammar comment per this many essay tokens
+        "specific_tokens_per_comment": 52,  # the same for SPS specific comments
+        "pse_min_paragraph_tokens": 75,  # shorter PSE paragraphs get no specific comments
+    },
+    # phrases flagged in every essay; see rules.RuleMatcher for the file format
+    "rules": [
+        {"path": "data/contractions.json", "comment": "Replace {match} with {replacement}"},
+        {"path": "data/second_person.json", "comment": "Avoid using second person"},
+    ],
 }
 
 # pricing per 1000 tokens, in dollars
@@ -41,3 +163,19 @@ pricing = {
         "completion_tokens": 0.06,
     },
 }
+
+# rate limits per model, per minute
+rate_limits = {
+    "gpt-3.5-turbo": {
+        "requests": 3500,
+        "tokens": 90000,
+    },
+    "gpt-4": {
+        "requests": 200,
+        "tokens": 40000,
+    },
+    "default": {
+        "requests": 200,
+        "tokens": 40000,
+    },
+}
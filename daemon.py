@@ -0,0 +1,154 @@
+import asyncio
+import signal
+
+from tqdm import tqdm
+
+from config import config
+from essay import get_ai_service
+from metrics import METRICS, Span
+from pipeline import Pipeline
+from services.drive_service import DriveService
+from services.sheets_service import SheetCursor, SheetsService
+from sheet_schema import SheetSchema
+from student_entry import StudentEntry
+from utils import float_to_dollar
+
+
+class Daemon:
+    # Long-running alternative to main.py's one-shot runs. Every poll_interval it
+    # asks Drive for the spreadsheet's version and only reads rows when that
+    # changed. New pending rows go into a bounded work queue, and a feeder moves
+    # them into one long-lived Pipeline, holding back while the pipeline is full
+    # or the OpenAI rate limit budget is spent. SIGTERM or SIGINT stop polling,
+    # and the submissions already in the pipeline are drained before exiting.
+    def __init__(self):
+        daemon_config = config["daemon"]
+        self.poll_interval: float = daemon_config["poll_interval"]
+        self.spreadsheet_id: str = config["spreadsheet"]["spreadsheet_id"]
+        self.work_queue: asyncio.Queue[StudentEntry] = asyncio.Queue(daemon_config["queue_size"])
+        self.stopping = asyncio.Event()
+        self.version: str | None = None
+        self.pipeline: Pipeline | None = None
+
+        # rows queued or in the pipeline, and the content hash of each row that
+        # finished (its mark may not have reached the sheet yet) until the cursor passes it
+        self.active: set[int] = set()
+        self.finished: dict[int, str] = {}
+        self.n_completed = 0
+        self.n_failed = 0
+
+    def stop(self):
+        if not self.stopping.is_set():
+            tqdm.write("Stopping: draining the submissions in flight")
+        self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        ss = SheetsService()
+        drive = DriveService()
+        cursor = SheetCursor.load()
+        ai_service = get_ai_service()
+        self.pipeline = Pipeline()
+
+        async with ai_service:
+            with Span("daemon"):
+                self.pipeline.start()
+                feeder = asyncio.create_task(self.feed(ai_service))
+                try:
+                    while not self.stopping.is_set():
+                        try:
+                            await self.poll(ss, drive, cursor)
+                        except Exception as e:
+                            tqdm.write(f"Warning: Failed to poll the sheet: {e!r}")
+                        try:
+                            await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    # submissions still in the work queue were never started and stay pending in the sheet
+                    feeder.cancel()
+                    await asyncio.gather(feeder, return_exceptions=True)
+                    await self.pipeline.join()
+                    METRICS.write()
+
+        n_completed = self.n_completed + len(self.pipeline.completed)
+        n_failed = self.n_failed + len(self.pipeline.failed)
+        print(
+            f"Processed {n_completed} submissions, {n_failed} failed, "
+            "total cost " + float_to_dollar(self.pipeline.total_cost)
+        )
+
+    async def poll(self, ss: SheetsService, drive: DriveService, cursor: SheetCursor):
+        if await self.collect_finished():
+            METRICS.write()
+
+        version = await asyncio.to_thread(drive.get_file_version, self.spreadsheet_id)
+        if version == self.version:
+            return
+
+        entries = await asyncio.to_thread(self.scan, ss, cursor)
+        self.version = version
+        for entry in entries:
+            if self.work_queue.full():
+                # read the sheet again next poll even if it doesn't change
+                self.version = None
+                break
+            self.work_queue.put_nowait(entry)
+            self.active.add(entry.row_index)
+
+    def scan(self, ss: SheetsService, cursor: SheetCursor) -> list[StudentEntry]:
+        # Returns the pending entries the daemon doesn't have yet, and moves the
+        # cursor up to the first row that is still pending.
+        schema = SheetSchema(ss.get_header())
+        entries: list[StudentEntry] = []
+        pending_rows: list[int] = []
+        next_row = cursor.next_row
+
+        for first_row, rows in ss.iter_row_chunks(cursor.next_row, schema.width):
+            next_row = first_row + len(rows)
+            for p in schema.pending_rows(rows):
+                row = first_row + p
+                if row in self.active:
+                    pending_rows.append(row)
+                    continue
+                entry = StudentEntry.from_row(row, rows[p], schema)
+                if len(entry.sps_essays) == 0 and len(entry.pse_essays) == 0:
+                    continue
+                pending_rows.append(row)
+                if self.finished.get(row) != entry.content_hash:
+                    entries.append(entry)
+
+        cursor.advance(min(pending_rows, default=next_row))
+        self.finished = {row: content_hash for row, content_hash in self.finished.items() if row >= cursor.next_row}
+        return entries
+
+    async def collect_finished(self) -> bool:
+        # Takes the finished submissions out of the pipeline so they can be freed;
+        # this also flushes their sheet marks and compacts the journal. Failed rows
+        # become pending again and are retried the next time the sheet changes.
+        # Returns whether anything finished since the last call.
+        completed, failed = await self.pipeline.take_finished()
+        for entry in completed:
+            self.active.discard(entry.row_index)
+            self.finished[entry.row_index] = entry.content_hash
+        for entry in failed:
+            self.active.discard(entry.row_index)
+        self.n_completed += len(completed)
+        self.n_failed += len(failed)
+        return bool(completed or failed)
+
+    async def feed(self, ai_service):
+        while True:
+            entry = await self.work_queue.get()
+            # hold new submissions back while the rate limit budget is spent
+            while (delay := ai_service.admission.delay()) > 0:
+                await asyncio.sleep(delay)
+            # waits while max_in_flight submissions are in the pipeline
+            await self.pipeline.submit(entry)
+
+
+if __name__ == "__main__":
+    asyncio.run(Daemon().run())
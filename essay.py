@@ -1,22 +1,40 @@
 import asyncio
-import json
 from abc import ABC, abstractmethod
 from datetime import datetime
+from functools import lru_cache, partial
 from uuid import uuid4
 
 from comments import Comment, QuotedComment
 from config import config
-from services.ai_service import AIService
-from services.firestore_service import FirestoreService
-from utils import longest_common_substring
+from layout import layout_runs
+from metrics import Span
+from packing import PACKING_INSTRUCTION, ReplySplitter, pack_paragraphs
+from quote_index import MIN_MATCH_RATIO, QuoteIndex
+from rules import get_rule_matcher
+from segmentation import Segmentation
+from tokens import count_tokens
 
-OAI_SERVICE = AIService()
+
+@lru_cache(maxsize=None)
+def get_ai_service():
+    # created on first use so importing essays doesn't load aiohttp or open the cache
+    from services.ai_service import AIService
+
+    return AIService()
+
+
+@lru_cache(maxsize=None)
+def get_router():
+    from services.model_router import ModelRouter
+
+    return ModelRouter(get_ai_service(), config["routing"])
 
 
 class Essay(ABC):
     def __init__(self, prompt: str, text: str):
         self.prompt: str = prompt.strip()
-        self.text = text.strip()
+        self.segmentation = Segmentation(text)
+        self.text = self.segmentation.text
         self.quote_comments: list[QuotedComment] = []
         self.general_comments: list[Comment] = []
         self.processing_costs = 0
@@ -24,111 +42,147 @@ class Essay(ABC):
     def __len__(self):
         return len(self.text)
 
-    def remove_double_spaces(self):
-        while self.text.find("  ") != -1:
-            self.text = self.text.replace("  ", " ")
-
     def get_paragraphs(self) -> list[str]:
-        return [
-            paragraph.strip()
-            for paragraph in self.text.split("\n")
-            if paragraph.strip() != ""
-        ]
+        return self.segmentation.paragraph_texts
 
     def character_count(self) -> int:
-        return sum([len(paragraph) for paragraph in self.get_paragraphs()])
+        return sum(end - start for start, end in self.segmentation.paragraphs)
 
     def is_multiple_paragraphs(self):
-        return len(self.get_paragraphs()) > 1
+        return len(self.segmentation.paragraphs) > 1
+
+    def quote_index(self) -> QuoteIndex:
+        return self.segmentation.quote_index
+
+    def parse_comment(
+        self,
+        output: str,
+        quote_comment_delim=" - ",
+        paragraph: int | None = None,
+        min_ratio: float = MIN_MATCH_RATIO,
+    ) -> tuple[bool, QuotedComment | None]:
+        # whether the line has the "quote" - suggestion shape, and its comment if
+        # at least min_ratio of the quote is found in the essay
+        if output.strip() == "":
+            return False, None
+
+        splits = output.split(quote_comment_delim)
+        quote = splits[0].strip().strip('"')
+        suggestion = " ".join(splits[1:]).strip()
+        parsed = len(splits) > 1 and quote != ""
+
+        span = self.find_quote(quote, paragraph, min_ratio)
+        if span is None:
+            return parsed, None
+
+        start_index, end_index = span
+        return parsed, QuotedComment(suggestion, self.text[start_index:end_index], start_index, end_index - start_index)
+
+    def find_quote(
+        self, quote: str, paragraph: int | None = None, min_ratio: float = MIN_MATCH_RATIO
+    ) -> tuple[int, int] | None:
+        # an exact match inside the paragraph the comment was written for wins
+        # over the best match anywhere in the essay
+        if paragraph is not None and quote != "":
+            paragraph_start, paragraph_end = self.segmentation.paragraphs[paragraph]
+            start_index = self.text.find(quote, paragraph_start, paragraph_end)
+            if start_index != -1:
+                return start_index, start_index + len(quote)
+        return self.quote_index().find(quote, min_ratio)
+
+    async def route_comments(
+        self, route: str, system_message: str, prompt: str, expected: int, new_parser=None, **kwargs
+    ):
+        # lines are anchored as they stream in; the comments are kept once the router accepts a reply
+        router = get_router()
+        if new_parser is None:
+            min_ratio = router.match_ratio(route)
+
+            def new_parser():
+                return partial(self.parse_comment, min_ratio=min_ratio)
+
+        with Span("generator", route=route):
+            comments, cost = await router.complete_comments(
+                route, system_message, prompt, expected, new_parser, **kwargs
+            )
+        self.quote_comments.extend(comments)
+        self.processing_costs += cost
 
-    def add_unparsed_comments(
-        self, unparsed_comments: list[str], quote_comment_delim=" - "
+    def pack_parser(self, pack, min_ratio: float = MIN_MATCH_RATIO):
+        # parses a packed reply, anchoring each line within the paragraph it is labeled with
+        splitter = ReplySplitter(pack.numbers)
+
+        def parse(line: str):
+            number, line = splitter.route(line)
+            return self.parse_comment(line, paragraph=None if number is None else number - 1, min_ratio=min_ratio)
+
+        return parse
+
+    async def generate_packed_comments(
+        self, route: str, system_message: str, numbers: list[int], comments_per_paragraph, **kwargs
     ):
-        for output in unparsed_comments:
-            if output.strip() == "":
-                continue
-
-            splits = output.split(quote_comment_delim)
-            quote = splits[0].strip()
-            suggestion = " ".join(splits[1:]).strip()
-
-            lcs = longest_common_substring(quote, self.text).strip()
-            if lcs == "":
-                continue
-
-            start_index = self.text.find(lcs)
-            length = len(lcs)
-            new_comment = QuotedComment(suggestion, lcs, start_index, length)
-            self.quote_comments.append(new_comment)
-
-    def generate_contraction_comments(self, path_to_contractions_data: str):
-        with open(path_to_contractions_data, "r") as f:
-            contractions: dict = json.load(f)
-
-        for contraction, correction in contractions.items():
-            contr_str = " " + contraction + " "
-            correction_str = f"Replace {contraction} with {correction}"
-
-            i = 0
-            while self.text.find(contr_str, i) != -1:
-                idx = self.text.find(contr_str, i)
-                start_index = idx + 1
-                length = 1
-                new_comment = QuotedComment(
-                    correction_str, contraction, start_index, length
-                )
-                self.quote_comments.append(new_comment)
-                i = idx + 1
-
-    def generate_second_person_comments(self, path_to_second_person_data: str):
-        with open(path_to_second_person_data, "r") as f:
-            second_person: list = json.load(f)
-
-        for word in second_person:
-            word_str = " " + word + " "
-            correction_str = "Avoid using second person"
-
-            i = 0
-            while self.text.find(word_str, i) != -1:
-                idx = self.text.find(word_str, i)
-                start_index = idx + 1
-                length = 1
-                new_comment = QuotedComment(correction_str, word, start_index, length)
-                self.quote_comments.append(new_comment)
-                i = idx + 1
-
-    def add_to_doc(self, document):
-        paragraph = document.add_paragraph()
-        current_index = 0
-        self.quote_comments.sort(key=lambda x: x.start_index)
-
-        for i, comment in enumerate(self.quote_comments):
-            start = comment.start_index
-            end = min(start + comment.length, len(self.text))
-            if i < len(self.quote_comments) - 1:
-                end = min(end, self.quote_comments[i + 1].start_index)
-                self.quote_comments[i + 1].start_index = max(
-                    self.quote_comments[i + 1].start_index, end
-                )
-
-            if start > current_index:
-                paragraph.add_run(self.text[current_index:start])
-
-            new_run = paragraph.add_run(self.text[start:end])
-            if comment.comment != "":
-                new_run.add_comment(comment.comment, author="EduAvenues", initials="EA")
-
-            current_index = end
-
-        if current_index < len(self.text):
-            paragraph.add_run(self.text[current_index:])
+        # Sends the paragraphs numbered `numbers` (from 1) in as few labeled
+        # requests as fit config["packing"]["max_prompt_tokens"], and anchors each
+        # reply line within the paragraph it is labeled with.
+        # comments_per_paragraph maps a paragraph's token count to the number of
+        # comments expected for it, which sizes max_tokens.
+        packing = config["packing"]
+        paragraphs = self.get_paragraphs()
+        packs = pack_paragraphs(
+            [paragraphs[number - 1] for number in numbers],
+            get_router().model(route),
+            packing["max_prompt_tokens"],
+            numbers,
+        )
 
-        for comment in self.general_comments:
-            document.add_paragraph("\n" + str(comment) + "\n")
+        async with asyncio.TaskGroup() as tg:
+            for pack in packs:
+                n_comments = max(sum(comments_per_paragraph(tokens) for tokens in pack.paragraph_tokens), 1)
+                tg.create_task(self.route_comments(
+                    route,
+                    system_message + PACKING_INSTRUCTION,
+                    pack.prompt,
+                    n_comments,
+                    lambda pack=pack: self.pack_parser(pack, get_router().match_ratio(route)),
+                    max_tokens=n_comments * packing["comment_tokens"],
+                    **kwargs,
+                ))
+
+    def generate_rule_comments(self):
+        for start_index, length, comment in get_rule_matcher().find_all(self.text):
+            quote = self.text[start_index: start_index + length]
+            self.quote_comments.append(QuotedComment(comment, quote, start_index, length))
+
+    def analysis(self) -> dict:
+        # the generated comments and their cost, as JSON-safe data for the journal
+        return {
+            "quote_comments": [
+                [comment.comment, comment.quote, comment.start_index, comment.length]
+                for comment in self.quote_comments
+            ],
+            "general_comments": [[comment.comment, comment.prefix] for comment in self.general_comments],
+            "processing_costs": self.processing_costs,
+        }
 
-        document.add_page_break()
+    def restore_analysis(self, analysis: dict):
+        self.quote_comments = [QuotedComment(*comment) for comment in analysis["quote_comments"]]
+        self.general_comments = [Comment(*comment) for comment in analysis["general_comments"]]
+        self.processing_costs = analysis["processing_costs"]
 
-    def upload_result_to_firestore(self):
+    def report_section(self) -> dict:
+        # plain data for report_renderer, which runs in another process
+        return {
+            "prompt": self.prompt,
+            "text": self.text,
+            "paragraphs": self.segmentation.paragraphs,
+            "runs": [
+                (run.start, run.end, [comment.comment for comment in run.comments if comment.comment != ""])
+                for run in layout_runs(len(self.text), self.quote_comments)
+            ],
+            "general_comments": [str(comment) for comment in self.general_comments],
+        }
+
+    def firestore_instructions(self) -> list[dict]:
         instructions = []
 
         essay_id = str(uuid4())
@@ -158,8 +212,7 @@ class Essay(ABC):
                 }
             )
 
-        fs = FirestoreService()
-        fs.batch_write(instructions)
+        return instructions
 
     @abstractmethod
     def to_dict(self):
@@ -178,9 +231,10 @@ class SPSEssay(Essay):
     async def generate_general_comment(self):
         system_message = f"As a guidance counselor assisting a student with their application essay for a prestigious tech-focused high school, your task is to provide constructive feedback for improvement. Consider the essay question, {self.prompt}, as the foundation for your feedback, ensuring that the recommendations align with the initial prompt. Respond with a compact, yet comprehensive paragraph containing your suggested enhancements." # noqa
 
-        completion, cost = await OAI_SERVICE.generate_chat_completion(
-            system_message, self.text, "gpt-3.5-turbo", max_tokens=256
-        )
+        with Span("generator", route="sps_general"):
+            completion, cost = await get_ai_service().generate_chat_completion(
+                system_message, self.text, get_router().model("sps_general"), max_tokens=256
+            )
 
         self.processing_costs += cost
         new_comment = Comment(completion, "General Comment:\n")
@@ -189,38 +243,28 @@ class SPSEssay(Essay):
     async def generate_grammar_comments(self):
         system_message = 'As an essay guidance counselor, your task is to help a student by identifying grammar mistakes in their writing. Your response should be formatted as a list with each line containing a specific error along with a brief excerpt from the student\'s essay that includes that error. Also provide a succinct suggestion for correcting the mistake.\n\nFor example:\n"want to be a engineer" - Change "a" to "an"\n"I is playing" - incorrect use of "is". Change to "am"' # noqa
 
-        paragraphs: list[str] = self.text.split("\n")
-
-        async with asyncio.TaskGroup() as tg:
-
-            tasks = []
-            for paragraph in paragraphs:
-                n_errors = max(len(paragraph) // 190, 1)
-                task = tg.create_task(OAI_SERVICE.generate_chat_completion(system_message,
-                                                                           paragraph,
-                                                                           "gpt-3.5-turbo",
-                                                                           max_tokens=n_errors * 80))
-                tasks.append(task)
-
-            for coro in asyncio.as_completed(tasks):
-                completion, cost = await coro
-                self.processing_costs += cost
-                unparsed_comments = completion.split("\n")
-                self.add_unparsed_comments(unparsed_comments)
+        tokens_per_comment = config["packing"]["grammar_tokens_per_comment"]
+        await self.generate_packed_comments(
+            "grammar",
+            system_message,
+            list(range(1, len(self.get_paragraphs()) + 1)),
+            lambda tokens: max(tokens // tokens_per_comment, 1),
+        )
 
     async def generate_specific_comments(self):
-        n_comments = len(self.text) // 210
+        tokens_per_comment = config["packing"]["specific_tokens_per_comment"]
+        n_comments = max(count_tokens(self.text, get_router().model("sps_specific")) // tokens_per_comment, 1)
 
         system_message = f"You're an essay guidance counselor assisting a student with their TJ application essay. Your key responsibility is to offer constructive suggestions aimed at refining the content and ideas of the essay. Based on the student's essay, generate {n_comments} insightful suggestions, each connected to a specific quote from the text. Format your advice as a list, where each entry begins with a brief quote from the essay, followed by your suggestion for improvement.\nRemember, your goal is to help shape the student's thoughts and arguments, enhancing the overall quality of the essay.\n\n\"Samantha was very angry\" - Try to 'show' the emotions instead of just 'telling'. This will make your narrative more engaging.\n\"I also play tennis\" - Keep your information relevant. Discuss aspects of your background that align with the theme of the essay prompt." # noqa
         oai_prompt = f"Essay Prompt:\n{self.prompt}\n\nApplicant's Essay:\n{self.text}"
-        completion, cost = await OAI_SERVICE.generate_chat_completion(
-            system_message, oai_prompt, "gpt-4", max_tokens=n_comments * 80
+        await self.route_comments(
+            "sps_specific",
+            system_message,
+            oai_prompt,
+            n_comments,
+            max_tokens=n_comments * config["packing"]["comment_tokens"],
         )
 
-        self.processing_costs += cost
-        unparsed_comments = completion.split("\n")
-        self.add_unparsed_comments(unparsed_comments)
-
     def to_dict(self) -> dict:
         return {
             "upload_time": datetime.now(),
@@ -231,19 +275,16 @@ class SPSEssay(Essay):
         }
 
     async def process(self, progress_bar=None):
-        self.remove_double_spaces()
-        self.generate_contraction_comments(config["contractions_data_path"])
-        self.generate_second_person_comments(config["second_person_data_path"])
-
-        async with asyncio.TaskGroup() as tg:
-            # tg.create_task(self.generate_grammar_comments())
-            tg.create_task(self.generate_specific_comments())
-            tg.create_task(self.generate_general_comment())
+        with Span("essay", type=self.essay_type):
+            self.generate_rule_comments()
 
-        try:
-            self.upload_result_to_firestore()
-        except Exception:
-            print("Warning: Failed to upload to Firestore.")
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    # tg.create_task(self.generate_grammar_comments())
+                    tg.create_task(self.generate_specific_comments())
+                    tg.create_task(self.generate_general_comment())
+            finally:
+                self.segmentation.release_quote_index()
 
         if progress_bar:
             progress_bar.update(1)
@@ -257,50 +298,36 @@ class PSEEssay(Essay):
     async def generate_general_comment(self):
         system_message = "You're an essay counselor helping a student craft their application essay for TJ, a highly selective technology high school. Assume that your reader possesses a strong mathematical background. The core objective of the essay is to exhibit the student's problem-solving strategies in written form.\nBased on the essay provided, offer your feedback in a succinct paragraph. Your recommendations should aim at enhancing the clarity, specificity, and effectiveness of how the student communicates their problem-solving strategies within the context of the essay." # noqa
         oai_prompt = f"Essay Prompt:\n{self.prompt}\n\nApplicant's Essay:\n{self.text}"
-        completion, cost = await OAI_SERVICE.generate_chat_completion(
-            system_message, oai_prompt, "gpt-3.5-turbo", max_tokens=400
-        )
+        with Span("generator", route="pse_general"):
+            completion, cost = await get_ai_service().generate_chat_completion(
+                system_message, oai_prompt, get_router().model("pse_general"), max_tokens=400
+            )
         self.processing_costs += cost
         new_comment = Comment(completion, "General Comment:\n")
         self.general_comments.append(new_comment)
 
     async def generate_grammar_comments(self):
-        n_errors = len(self.text) // 200
+        tokens_per_comment = config["packing"]["grammar_tokens_per_comment"]
+        n_errors = max(count_tokens(self.text, get_router().model("grammar")) // tokens_per_comment, 1)
         system_message = 'As an essay guidance counselor, your task is to help a student by identifying grammar mistakes in their writing. Your response should be formatted as a list with each line containing a specific error along with a brief excerpt from the student\'s essay that includes that error. Also provide a succinct suggestion for correcting the mistake.\n\nFor example:\n"want to be a engineer" - Change "a" to "an"\n"I is playing" - incorrect use of "is". Change to "am"' # noqa
 
-        completion, cost = await OAI_SERVICE.generate_chat_completion(
-            system_message, self.text, "gpt-3.5-turbo", max_tokens=n_errors * 80
+        await self.route_comments(
+            "grammar", system_message, self.text, n_errors, max_tokens=n_errors * config["packing"]["comment_tokens"]
         )
 
-        self.processing_costs += cost
-        unparsed_comments = completion.split("\n")
-        self.add_unparsed_comments(unparsed_comments)
-
     async def generate_specific_comments(self):
 
         system_message = 'As an essay counselor, your task is to assist a student in articulating their problem-solving process within a written essay. We\'re not focusing on the mathematical accuracy but instead the clarity and flow of the explanation, and the organization of the essay. You should provide recommendations for improving these aspects, without considering the correctness of mathematical logic.\nRespond with a newline-separated list of 5 distinct suggestions for the student, each tied to a specific quote from the text. Your suggestions should aim to enhance the coherence, organization, and clarity of the student\'s explanation\n\nFor example:\n"First, I calculated the sum" - Add more context. What exactly are you summing here and why is it important?\n"This result is impossible" - Suggest: Instead of stating it\'s impossible, explain why it contradicts known principles or assumptions.' # noqa
 
-        paragraphs: list[str] = self.text.split("\n")
-
-        async with asyncio.TaskGroup() as tg:
-
-            tasks = []
-            for paragraph in paragraphs:
-                n_errors = 1 if len(paragraph) > 300 else 0
-                if n_errors == 0:
-                    continue
-                task = tg.create_task(OAI_SERVICE.generate_chat_completion(system_message,
-                                                                           paragraph,
-                                                                           "gpt-4",
-                                                                           max_tokens=n_errors * 80,
-                                                                           temperature=0.5))
-                tasks.append(task)
-
-            for coro in asyncio.as_completed(tasks):
-                completion, cost = await coro
-                self.processing_costs += cost
-                unparsed_comments = completion.split("\n")
-                self.add_unparsed_comments(unparsed_comments)
+        min_tokens = config["packing"]["pse_min_paragraph_tokens"]
+        numbers = [
+            number for number, paragraph in enumerate(self.get_paragraphs(), start=1)
+            if count_tokens(paragraph, get_router().model("pse_specific")) >= min_tokens
+        ]
+        if numbers:
+            await self.generate_packed_comments(
+                "pse_specific", system_message, numbers, lambda tokens: 1, temperature=0.5
+            )
 
     def to_dict(self) -> dict:
         return {
@@ -312,19 +339,17 @@ class PSEEssay(Essay):
         }
 
     async def process(self, progress_bar=None):
-        self.remove_double_spaces()
-        self.generate_contraction_comments(config["contractions_data_path"])
-        self.generate_second_person_comments(config["second_person_data_path"])
-
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(self.generate_general_comment())
-            # tg.create_task(self.generate_grammar_comments()) # not sure if we want these. Going to leave them out.
-            tg.create_task(self.generate_specific_comments())
-
-        try:
-            self.upload_result_to_firestore()
-        except Exception:
-            print("Warning: Failed to upload to Firestore.")
+        with Span("essay", type=self.essay_type):
+            self.generate_rule_comments()
+
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(self.generate_general_comment())
+                    # not sure if we want these. Going to leave them out.
+                    # tg.create_task(self.generate_grammar_comments())
+                    tg.create_task(self.generate_specific_comments())
+            finally:
+                self.segmentation.release_quote_index()
 
         if progress_bar:
             progress_bar.update(1)
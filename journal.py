@@ -0,0 +1,111 @@
+import json
+import time
+
+from storage import open_sqlite
+
+# stages in the order a submission finishes them
+STAGES = ["analyzed", "rendered", "uploaded", "marked"]
+
+
+class Checkpoint:
+    # What the journal holds for one submission: the outputs of every stage it
+    # finished before, or None for the stages it still has to run.
+    __slots__ = ("analysis", "report", "link", "marked")
+
+    def __init__(
+        self,
+        analysis: dict | None = None,
+        report: bytes | None = None,
+        link: str | None = None,
+        marked: bool = False,
+    ):
+        self.analysis = analysis
+        self.report = report
+        self.link = link
+        self.marked = marked
+
+    @property
+    def stage(self) -> str | None:
+        # The last finished stage. A later stage implies the earlier ones: the
+        # report is dropped once its link is recorded.
+        finished = [self.analysis is not None, self.report is not None, self.link is not None, self.marked]
+        for stage, done in reversed(list(zip(STAGES, finished))):
+            if done:
+                return stage
+        return None
+
+
+class Journal:
+    # Stage-level checkpoints keyed by sheet row and a hash of the submission's
+    # content, so a crashed run resumes each submission at its first unfinished
+    # stage instead of paying for its completions again. An edited submission
+    # hashes differently and starts over. Marked entries are only needed until
+    # the sheet shows them completed; compact() drops them after `retention`
+    # seconds, and drops unfinished ones nobody resumed after `stale_after`.
+    def __init__(self, path: str, retention: float, stale_after: float):
+        self.retention = retention
+        self.stale_after = stale_after
+
+        self.conn, self.lock = open_sqlite(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "row INTEGER NOT NULL, content_hash TEXT NOT NULL, "
+            "analysis TEXT, report BLOB, link TEXT, marked_at REAL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (row, content_hash))"
+        )
+
+    def load(self, row: int, content_hash: str) -> Checkpoint:
+        with self.lock:
+            result = self.conn.execute(
+                "SELECT analysis, report, link, marked_at FROM checkpoints WHERE row = ? AND content_hash = ?",
+                (row, content_hash),
+            ).fetchone()
+        if result is None:
+            return Checkpoint()
+
+        analysis, report, link, marked_at = result
+        return Checkpoint(json.loads(analysis) if analysis else None, report, link, marked_at is not None)
+
+    def _set(self, row: int, content_hash: str, column: str, value):
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO checkpoints (row, content_hash, {column}, updated_at) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT (row, content_hash) DO UPDATE SET {column} = excluded.{column}, "
+                "updated_at = excluded.updated_at",
+                (row, content_hash, value, time.time()),
+            )
+
+    def record_analysis(self, row: int, content_hash: str, analysis: dict):
+        self._set(row, content_hash, "analysis", json.dumps(analysis))
+
+    def record_report(self, row: int, content_hash: str, report: bytes):
+        self._set(row, content_hash, "report", report)
+
+    def record_link(self, row: int, content_hash: str, link: str):
+        # the report is in Drive now, so its bytes aren't needed any more
+        with self.lock:
+            self.conn.execute(
+                "UPDATE checkpoints SET link = ?, report = NULL, updated_at = ? WHERE row = ? AND content_hash = ?",
+                (link, time.time(), row, content_hash),
+            )
+
+    def record_marked(self, keys: list[tuple[int, str]]):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE checkpoints SET marked_at = ?, updated_at = ? WHERE row = ? AND content_hash = ?",
+                [(now, now, row, content_hash) for row, content_hash in keys],
+            )
+
+    def compact(self) -> int:
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "DELETE FROM checkpoints WHERE (marked_at IS NOT NULL AND marked_at < ?) OR updated_at < ?",
+                (now - self.retention, now - self.stale_after),
+            )
+            return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
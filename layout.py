@@ -0,0 +1,56 @@
+from comments import QuotedComment
+
+
+class AnnotatedRun:
+    __slots__ = ("start", "end", "comments")
+
+    def __init__(self, start: int, end: int, comments: list[QuotedComment] | None = None):
+        self.start = start
+        self.end = end
+        self.comments: list[QuotedComment] = comments if comments is not None else []
+
+    def __repr__(self):
+        return f"AnnotatedRun(start={self.start}, end={self.end}, n_comments={len(self.comments)})"
+
+
+def layout_runs(text_length: int, comments: list[QuotedComment]) -> list[AnnotatedRun]:
+    # Splits [0, text_length) into non-overlapping runs. Overlapping and
+    # duplicate comment spans are merged into a single run that carries all of
+    # their comments (duplicate comment texts are kept once); the text between
+    # them becomes runs without comments. After the sort, this is one linear
+    # sweep over the comments.
+    spans = sorted(
+        (
+            (max(0, comment.start_index), min(comment.end_index, text_length), comment)
+            for comment in comments
+        ),
+        key=lambda span: (span[0], span[1]),
+    )
+
+    merged: list[AnnotatedRun] = []
+    seen: set[str] = set()
+    for start, end, comment in spans:
+        if start >= end:
+            continue
+        if merged and start < merged[-1].end:
+            current = merged[-1]
+            current.end = max(current.end, end)
+        else:
+            current = AnnotatedRun(start, end)
+            merged.append(current)
+            seen = set()
+
+        if comment.comment not in seen:
+            seen.add(comment.comment)
+            current.comments.append(comment)
+
+    runs: list[AnnotatedRun] = []
+    position = 0
+    for run in merged:
+        if run.start > position:
+            runs.append(AnnotatedRun(position, run.start))
+        runs.append(run)
+        position = run.end
+    if position < text_length:
+        runs.append(AnnotatedRun(position, text_length))
+    return runs
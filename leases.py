@@ -0,0 +1,163 @@
+import time
+from abc import ABC, abstractmethod
+
+from config import config
+from storage import open_sqlite
+
+
+class LeaseCoordinator(ABC):
+    # Hands out time-limited leases on sheet rows so that several workers can
+    # share one sheet without processing a row twice. A lease is free once it
+    # has expired, so the rows of a worker that died are re-issued after `ttl`.
+    def __init__(self, worker_id: str, ttl: float):
+        self.worker_id = worker_id
+        self.ttl = ttl
+
+    @abstractmethod
+    def acquire(self, rows: list[int]) -> list[int]:
+        # leases every row that is free, expired or already ours; returns those rows
+        pass
+
+    @abstractmethod
+    def renew(self, rows: list[int]) -> list[int]:
+        # extends our leases on rows; returns the rows that were still ours
+        pass
+
+    @abstractmethod
+    def release(self, rows: list[int]):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaseCoordinator(LeaseCoordinator):
+    # For workers on one host: leases live in a shared SQLite file and are taken
+    # inside write transactions, so two workers never hold the same row.
+    def __init__(self, worker_id: str, ttl: float, path: str):
+        super().__init__(worker_id, ttl)
+        # workers wait up to 30s for each other's write transactions
+        self.conn, self.lock = open_sqlite(path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "row INTEGER PRIMARY KEY, worker_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _claim(self, rows: list[int], only_ours: bool) -> list[int]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    if only_ours:
+                        self.conn.execute(
+                            "UPDATE leases SET expires_at = ? WHERE row = ? AND worker_id = ?",
+                            (now + self.ttl, row, self.worker_id),
+                        )
+                        continue
+                    self.conn.execute(
+                        "INSERT INTO leases (row, worker_id, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (row) DO UPDATE SET worker_id = excluded.worker_id, "
+                        "expires_at = excluded.expires_at "
+                        "WHERE leases.worker_id = excluded.worker_id OR leases.expires_at < ?",
+                        (row, self.worker_id, now + self.ttl, now),
+                    )
+                held = {
+                    row
+                    for (row,) in self.conn.execute(
+                        "SELECT row FROM leases WHERE worker_id = ? AND expires_at > ?", (self.worker_id, now)
+                    )
+                }
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [row for row in rows if row in held]
+
+    def acquire(self, rows: list[int]) -> list[int]:
+        return self._claim(rows, only_ours=False)
+
+    def renew(self, rows: list[int]) -> list[int]:
+        return self._claim(rows, only_ours=True)
+
+    def release(self, rows: list[int]):
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM leases WHERE row = ? AND worker_id = ?", [(row, self.worker_id) for row in rows]
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SheetLeaseCoordinator(LeaseCoordinator):
+    # For workers on several hosts: a lease is a "worker_id expires_at" value in
+    # the sheet's lease column. The Sheets API has no compare-and-set, so a
+    # worker writes its claim, waits `settle_delay` for competing writes to land
+    # and keeps only the rows that still show its own claim. Renewals re-check
+    # ownership the same way.
+    def __init__(self, worker_id: str, ttl: float, sheets_service, column: str, settle_delay: float):
+        super().__init__(worker_id, ttl)
+        self.sheets_service = sheets_service
+        self.column = column
+        self.settle_delay = settle_delay
+
+    def _holder(self, value: str, now: float) -> str | None:
+        # the worker holding an unexpired lease, or None
+        worker_id, _, expires_at = value.rpartition(" ")
+        try:
+            return worker_id if worker_id and float(expires_at) > now else None
+        except ValueError:
+            return None
+
+    def _claim(self, rows: list[int], only_ours: bool) -> list[int]:
+        if not rows:
+            return []
+        now = time.time()
+        current = self.sheets_service.get_cells(self.column, rows)
+        claimable = []
+        for row in rows:
+            holder = self._holder(current.get(row, ""), now)
+            if holder == self.worker_id or (holder is None and not only_ours):
+                claimable.append(row)
+        if not claimable:
+            return []
+
+        claim = f"{self.worker_id} {now + self.ttl:.0f}"
+        self.sheets_service.write_cells(self.column, {row: claim for row in claimable})
+        time.sleep(self.settle_delay)
+
+        after = self.sheets_service.get_cells(self.column, claimable)
+        return [row for row in claimable if after.get(row) == claim]
+
+    def acquire(self, rows: list[int]) -> list[int]:
+        return self._claim(rows, only_ours=False)
+
+    def renew(self, rows: list[int]) -> list[int]:
+        return self._claim(rows, only_ours=True)
+
+    def release(self, rows: list[int]):
+        if not rows:
+            return
+        current = self.sheets_service.get_cells(self.column, rows)
+        ours = [row for row in rows if self._holder(current.get(row, ""), time.time()) == self.worker_id]
+        if ours:
+            self.sheets_service.write_cells(self.column, {row: "" for row in ours})
+
+
+def create_coordinator(worker_id: str, backend: str, sheets_service=None) -> LeaseCoordinator:
+    lease_config = config["leases"]
+    if backend == "sqlite":
+        return SQLiteLeaseCoordinator(worker_id, lease_config["ttl"], lease_config["path"])
+    if backend == "sheet":
+        if not config["spreadsheet"]["lease_column"]:
+            raise ValueError('Set config["spreadsheet"]["lease_column"] to use the sheet lease backend')
+        return SheetLeaseCoordinator(
+            worker_id,
+            lease_config["ttl"],
+            sheets_service,
+            config["spreadsheet"]["lease_column"],
+            lease_config["settle_delay"],
+        )
+    raise ValueError(f"Unknown lease backend: {backend!r}")
@@ -1,72 +1,205 @@
+import argparse
 import asyncio
+import os
 import sys
 
 from config import config
-from services.sheets_service import SheetsService
+from essay import get_ai_service, get_router
+from leases import LeaseCoordinator, create_coordinator
+from metrics import METRICS, Span, increment
+from pipeline import Pipeline
+from services.sheets_service import SheetCursor, SheetsService
+from sheet_schema import SheetSchema
 from student_entry import StudentEntry
 from utils import float_to_dollar
 
 
-async def main():
-    # PART 1: GET DATA FROM SHEET
-    limit: int = config["limit"]
-    completed_column: str = config["spreadsheet"]["completed_column"]
-    student_email_column: str = config["spreadsheet"]["student_email_column"]
-    parent_email_column: str = config["spreadsheet"]["parent_email_column"]
-    reported_gpt_column: str = config["spreadsheet"]["reported_gpa_column"]
-    middle_school_column: str = config["spreadsheet"]["middle_school_column"]
-
-    student_email_index = ord(student_email_column) - 65
-    parent_email_index = ord(parent_email_column) - 65
-    complted_index = ord(completed_column) - 65
-    reported_gpa_index = ord(reported_gpt_column) - 65
-    middle_school_index = ord(middle_school_column) - 65
-
-    ss = SheetsService()
-
-    df = ss.get_rows()
-
+def lease_rows(ss: SheetsService, leases: LeaseCoordinator, rows: list[int]) -> tuple[set[int], set[int]]:
+    # Leases rows and returns the granted ones that still need processing, and
+    # those found completed. The rows were read before they were leased, so
+    # another worker may have finished and released some of them in between.
+    granted = leases.acquire(rows)
+    if not granted:
+        return set(), set()
+    cells = ss.get_cells(config["spreadsheet"]["completed_column"], granted)
+    completed = {row for row, value in cells.items() if value == "TRUE"}
+    if completed:
+        leases.release(sorted(completed))
+    return set(granted) - completed, completed
+
+
+def claim_pending(
+    ss: SheetsService, first_row: int, pending: list[int], remaining: int, leases: LeaseCoordinator | None
+) -> tuple[list[int], list[int]]:
+    # Picks up to `remaining` of a chunk's pending positions: the first ones, or
+    # in worker mode the first ones this worker manages to lease. Returns them
+    # and the rows this run leaves unfinished.
+    if leases is None:
+        unfinished = [first_row + pending[remaining]] if len(pending) > remaining else []
+        return pending[:remaining], unfinished
+
+    taken: list[int] = []
+    unfinished: list[int] = []
+    while pending and len(taken) < remaining:
+        n = remaining - len(taken)
+        batch, pending = pending[:n], pending[n:]
+        rows = [first_row + p for p in batch]
+        granted, completed = lease_rows(ss, leases, rows)
+        for p, row in zip(batch, rows):
+            if row in granted:
+                taken.append(p)
+            elif row not in completed:
+                # leased by another worker
+                unfinished.append(row)
+    if pending:
+        unfinished.append(first_row + pending[0])
+    return taken, unfinished
+
+
+def get_pending_entries(
+    ss: SheetsService,
+    cursor: SheetCursor,
+    schema: SheetSchema,
+    limit: int,
+    leases: LeaseCoordinator | None = None,
+):
+    # Returns up to `limit` pending entries from the cursor on, the pending rows
+    # this run won't finish (the cursor must not move past them) and the row
+    # after the last one read.
     student_entries: list[StudentEntry] = []
+    unfinished_rows: list[int] = []
+    next_row = cursor.next_row
 
-    i = config["spreadsheet"]["row_start"]
-    n = 0
+    for first_row, rows in ss.iter_row_chunks(cursor.next_row, schema.width):
+        next_row = first_row + len(rows)
 
-    for _, row in df.iterrows():
-        if n >= limit:
-            break
+        pending, unfinished = claim_pending(
+            ss, first_row, schema.pending_rows(rows), limit - len(student_entries), leases
+        )
+        unfinished_rows += unfinished
 
-        assert student_email_index >= 0, "Invalid student email column"
-        assert complted_index >= 0, "Invalid completed column"
-
-        student_email = row[student_email_index]
-
-        if row[complted_index] != "TRUE" and student_email is not None:
-            gpa_str = str(row[reported_gpa_index])
-            entry = StudentEntry(
-                dict(row),
-                i,
-                row[student_email_index],
-                row[parent_email_index],
-                gpa_str,
-                row[middle_school_index],
-            )
+        for p in pending:
+            entry = StudentEntry.from_row(first_row + p, rows[p], schema)
             if len(entry.sps_essays) != 0 or len(entry.pse_essays) != 0:
                 student_entries.append(entry)
-                n += 1
-        i += 1
+            elif leases is not None:
+                leases.release([entry.row_index])
+
+        if len(student_entries) >= limit:
+            break
+
+    return student_entries, unfinished_rows, next_row
+
+
+async def renew_leases(leases: LeaseCoordinator, pipeline: Pipeline, rows: list[int]):
+    # keeps the leases on rows that are still in the pipeline from expiring
+    interval = config["leases"]["heartbeat_interval"]
+    while True:
+        await asyncio.sleep(interval)
+        finished = {entry.row_index for entry in pipeline.completed + pipeline.failed}
+        in_flight = [row for row in rows if row not in finished]
+        try:
+            held = await asyncio.to_thread(leases.renew, in_flight)
+        except Exception as e:
+            print(f"Warning: Failed to renew leases: {e!r}")
+            continue
+        lost = sorted(set(in_flight) - set(held))
+        if lost:
+            print(f"Warning: Lost the leases on rows {lost}; another worker may process them too")
+
+
+async def process_batch(leases: LeaseCoordinator | None = None) -> Pipeline | None:
+    # PART 1: GET DATA FROM SHEET
+    limit: int = config["limit"]
+
+    ss = SheetsService()
+    cursor = SheetCursor.load()
+    schema = SheetSchema(ss.get_header())
+
+    student_entries, unfinished_rows, next_row = get_pending_entries(ss, cursor, schema, limit, leases)
 
+    n = len(student_entries)
     if n == 0:
+        cursor.advance(min(unfinished_rows, default=next_row))
         print("No new entries to process")
+        return None
+
+    ai_service = get_ai_service()
+    pipeline = Pipeline()
+    leased_rows = [entry.row_index for entry in student_entries]
+    heartbeat = asyncio.create_task(renew_leases(leases, pipeline, leased_rows)) if leases else None
+    async with ai_service:
+        try:
+            await pipeline.run(student_entries)
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+                # completed rows are marked in the sheet now, and failed ones are up for grabs again
+                await asyncio.to_thread(leases.release, leased_rows)
+        cache = ai_service.cache
+        if cache is not None and cache.hits:
+            print(f"Completion cache: {cache.hits} hits, saved " + float_to_dollar(cache.cost_saved))
+            increment("llm_cache_hits", cache.hits)
+            increment("llm_cache_saved_dollars", cache.cost_saved)
+
+    unfinished_rows += [entry.row_index for entry in pipeline.failed]
+    if not pipeline.marks_flushed:
+        unfinished_rows += [entry.row_index for entry in pipeline.completed]
+    cursor.advance(min(unfinished_rows, default=next_row))
+
+    n_completed = len(pipeline.completed)
+    n_failed = len(pipeline.failed)
+    if pipeline.resumed:
+        print(f"Resumed {len(pipeline.resumed)} submissions from the journal")
+    print("Successfully processed " + str(n_completed) + f" submission{'s' if n_completed != 1 else ''}")
+    if n_failed:
+        print("Failed to process " + str(n_failed) + f" submission{'s' if n_failed != 1 else ''}")
+    print("Total cost: " + float_to_dollar(pipeline.total_cost))
+    if ai_service.retry_stats.counters:
+        print("AI service calls: " + ai_service.retry_stats.summary())
+    for line in get_router().summary():
+        print("Routing " + line)
+    if ai_service.stream_timings:
+        print("Streamed completions: " + ai_service.stream_summary())
+
+    return pipeline
+
+
+async def main(worker_id: str | None = None, lease_backend: str = "sqlite"):
+    # With a worker id this process is one of several workers sharing the sheet,
+    # and only processes the rows it leases. Each worker writes its own run report.
+    if worker_id:
+        metrics_config = config["metrics"]
+        for key in ("report_path", "prometheus_path"):
+            root, extension = os.path.splitext(metrics_config[key])
+            metrics_config[key] = f"{root}.{worker_id}{extension}"
+    leases = create_coordinator(worker_id, lease_backend, SheetsService()) if worker_id else None
+    try:
+        with Span("run", worker_id=worker_id):
+            pipeline = await process_batch(leases)
+    finally:
+        METRICS.write()
+        if leases is not None:
+            leases.close()
+
+    if pipeline is None:
         sys.exit(0)
+    print("Run report written to " + config["metrics"]["report_path"])
+    return pipeline
 
-    total_cost = 0
-    for entry in student_entries:
-        cost = await entry.process()
-        total_cost += cost
 
-    print("Successfully processed " + str(n) + f" submission{'s' if n > 1 else ''}")
-    print("Total cost: " + float_to_dollar(total_cost))
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate feedback reports for the pending rows of the sheet.")
+    parser.add_argument("--worker-id", help="run as one of several workers, each processing the rows it leases")
+    parser.add_argument(
+        "--lease-backend",
+        choices=["sqlite", "sheet"],
+        default="sqlite",
+        help="sqlite for workers on one host, sheet for workers on several hosts",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    asyncio.run(main(args.worker_id, args.lease_backend))
@@ -0,0 +1,217 @@
+import functools
+import inspect
+import json
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from itertools import count
+
+from config import config
+from storage import write_atomic
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+_span_ids = count(1)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+class Histogram:
+    # Cumulative bucket counts plus count, sum and max, so memory stays constant
+    # however long the process runs. Percentiles are estimated as the upper
+    # bound of the bucket they fall in.
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        for bound, n in zip(BUCKETS, self.buckets):
+            if n >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    # Everything recorded in one run: finished spans, latency histograms keyed
+    # by (name, labels) and counters keyed the same way.
+    def __init__(self):
+        self.started_at = time.time()
+        self.spans: list[dict] = []
+        self.dropped_spans = 0
+        self.histograms: dict[tuple, Histogram] = defaultdict(Histogram)
+        self.counters: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, name: str, value: float, **labels):
+        self.histograms[(name, _labels(labels))].observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        self.counters[(name, _labels(labels))] += value
+
+    def record_span(self, span: "Span"):
+        self.observe("span_seconds", span.duration, span=span.name, model=span.attributes.get("model"))
+        if len(self.spans) >= config["metrics"]["max_spans"]:
+            self.dropped_spans += 1
+            return
+        self.spans.append(
+            {
+                "id": span.id,
+                "parent_id": span.parent.id if span.parent else None,
+                "name": span.name,
+                "start": span.start_time - self.started_at,
+                "duration": span.duration,
+                "attributes": span.attributes,
+            }
+        )
+
+    def report(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "duration": time.time() - self.started_at,
+            "histograms": [
+                {"name": name, "labels": dict(labels), **histogram.summary()}
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            "spans": self.spans,
+            "dropped_spans": self.dropped_spans,
+        }
+
+    def prometheus(self) -> str:
+        prefix = config["metrics"]["prefix"]
+        lines = []
+
+        def label_text(labels: tuple, extra: tuple = ()) -> str:
+            pairs = [f'{key}="{value}"' for key, value in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                for bound, bucket in zip(BUCKETS, histogram.buckets):
+                    lines.append(f"{prefix}_{name}_bucket{label_text(labels, (('le', str(bound)),))} {bucket}")
+                lines.append(f"{prefix}_{name}_bucket{label_text(labels, (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{prefix}_{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{prefix}_{name}_count{label_text(labels)} {histogram.count}")
+
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f"{prefix}_{name}_total{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # the JSON run report and a Prometheus textfile-collector file, each replaced atomically
+        metrics_config = config["metrics"]
+        for path, content in (
+            (metrics_config["report_path"], json.dumps(self.report(), indent=2, default=str)),
+            (metrics_config["prometheus_path"], self.prometheus()),
+        ):
+            write_atomic(path, content)
+
+
+METRICS = Metrics()
+
+
+class Span:
+    # A timed operation, nested under the span that was current where it was
+    # created (or under `parent`). Use it as a context manager in sync or async
+    # code, which also makes it current for everything started inside, including
+    # tasks and to_thread calls; or call start() and finish() for work that is
+    # handed between tasks.
+    def __init__(self, name: str, parent: "Span | None" = None, **attributes):
+        self.id = next(_span_ids)
+        self.name = name
+        self.parent = parent or _current_span.get()
+        self.attributes = attributes
+        self.start_time = 0.0
+        self.duration = 0.0
+        self._started = 0.0
+        self._token = None
+
+    def start(self) -> "Span":
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def finish(self, **attributes):
+        self.attributes.update(attributes)
+        self.duration = time.perf_counter() - self._started
+        METRICS.record_span(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc_type is None:
+            self.finish()
+        else:
+            self.finish(error=exc_type.__name__)
+
+    async def __aenter__(self) -> "Span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+
+
+def traced(name: str | None = None, **attributes):
+    # decorator that runs every call of a sync or async function in its own span
+    def decorate(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrap_async(*args, **kwargs):
+                with Span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+
+            return wrap_async
+
+        @functools.wraps(func)
+        def wrap(*args, **kwargs):
+            with Span(span_name, **attributes):
+                return func(*args, **kwargs)
+
+        return wrap
+
+    return decorate
+
+
+def observe(name: str, value: float, **labels):
+    METRICS.observe(name, value, **labels)
+
+
+def increment(name: str, value: float = 1, **labels):
+    METRICS.increment(name, value, **labels)
@@ -0,0 +1,74 @@
+import re
+
+from tokens import count_tokens
+
+LABEL = re.compile(r"^\s*\[P(\d+)\]\s*")
+
+# appended to the system message of every packed request
+PACKING_INSTRUCTION = (
+    "\n\nThe student's text is split into paragraphs, each starting with a label such as [P1]. "
+    "Start every line of your response with the label of the paragraph that line refers to."
+)
+
+
+def label(number: int) -> str:
+    return f"[P{number}]"
+
+
+class ParagraphPack:
+    # Paragraphs sent together in one request, numbered from 1 in essay order.
+    __slots__ = ("numbers", "prompt", "paragraph_tokens")
+
+    def __init__(self, numbers: list[int], prompt: str, paragraph_tokens: list[int]):
+        self.numbers = numbers
+        self.prompt = prompt
+        # each paragraph's own token count, without its label
+        self.paragraph_tokens = paragraph_tokens
+
+
+def pack_paragraphs(
+    paragraphs: list[str], model: str, max_prompt_tokens: int, numbers: list[int] | None = None
+) -> list[ParagraphPack]:
+    # Greedily groups consecutive labeled paragraphs into as few prompts as fit
+    # in max_prompt_tokens. A paragraph that is too long on its own gets a pack
+    # to itself. `numbers` gives each paragraph's label, defaulting to 1..n.
+    numbers = numbers or list(range(1, len(paragraphs) + 1))
+    packs: list[ParagraphPack] = []
+    lines: list[str] = []
+    pack_numbers: list[int] = []
+    paragraph_tokens: list[int] = []
+    pack_tokens = 0
+
+    for number, paragraph in zip(numbers, paragraphs):
+        prefix = label(number) + " "
+        tokens = count_tokens(paragraph, model)
+        # the label and the newline joining it to the previous paragraph
+        line_tokens = tokens + count_tokens(prefix, model) + 1
+        if lines and pack_tokens + line_tokens > max_prompt_tokens:
+            packs.append(ParagraphPack(pack_numbers, "\n".join(lines), paragraph_tokens))
+            lines, pack_numbers, paragraph_tokens, pack_tokens = [], [], [], 0
+        lines.append(prefix + paragraph)
+        pack_numbers.append(number)
+        paragraph_tokens.append(tokens)
+        pack_tokens += line_tokens
+
+    if lines:
+        packs.append(ParagraphPack(pack_numbers, "\n".join(lines), paragraph_tokens))
+    return packs
+
+
+class ReplySplitter:
+    # Routes reply lines, one at a time, to the paragraph label they start with.
+    # Unlabeled lines belong to the last label seen; lines before any label, or
+    # with a label that wasn't in the request, go to None.
+    def __init__(self, numbers: list[int]):
+        self.known = set(numbers)
+        self.current = numbers[0] if len(numbers) == 1 else None
+
+    def route(self, line: str) -> tuple[int | None, str]:
+        match = LABEL.match(line)
+        if match:
+            number = int(match.group(1))
+            self.current = number if number in self.known else None
+            line = line[match.end():]
+        return self.current, line
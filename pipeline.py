@@ -0,0 +1,257 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from config import config
+from journal import Checkpoint, Journal
+from metrics import Span
+from report_renderer import render_report
+from services.drive_service import DriveService
+from services.firestore_writer import FirestoreWriter
+from services.sheets_service import SheetsService
+from student_entry import StudentEntry
+from utils import float_to_dollar
+
+
+class Job:
+    def __init__(self, entry: StudentEntry):
+        self.entry = entry
+        self.report: bytes | None = None
+        self.link: str = ""
+        self.started_at = time.time()
+        self.checkpoint = Checkpoint()
+        # stage the checkpoint had reached when loaded; the stages consume parts of it
+        self.resumed_after: str | None = None
+        # parent of the job's stage spans, finished when it leaves the pipeline
+        self.span = Span("submission", row=entry.row_index).start()
+
+
+class Pipeline:
+    # Stages: analyze -> render -> upload -> mark, joined by bounded queues.
+    # At most `max_in_flight` submissions are held between submit() and the
+    # end of the mark stage, which caps the number of rendered reports in memory.
+    # Reports are rendered in a process pool so docx work never blocks the event loop.
+    # With the journal enabled every finished stage is checkpointed, and a
+    # submission that was checkpointed by an earlier run skips the stages it finished.
+    def __init__(self, max_in_flight: int | None = None):
+        pipeline_config = config["pipeline"]
+        self.max_in_flight: int = max_in_flight or pipeline_config["max_in_flight"]
+        self.queue_size: int = pipeline_config["queue_size"]
+        self.upload_workers: int = pipeline_config["upload_workers"]
+        self.render_workers: int = config["report"]["render_workers"]
+        self.render_pool: ProcessPoolExecutor | None = None
+        self.drive_service: DriveService | None = None
+        self.sheets_service: SheetsService | None = None
+        self.firestore_writer: FirestoreWriter | None = None
+        self.journal: Journal | None = None
+        self.marks_flushed = True
+
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.analyze_queue: asyncio.Queue[Job] = asyncio.Queue(self.queue_size)
+        self.render_queue: asyncio.Queue[Job] = asyncio.Queue(self.queue_size)
+        self.upload_queue: asyncio.Queue[Job] = asyncio.Queue(self.queue_size)
+        self.mark_queue: asyncio.Queue[Job] = asyncio.Queue(self.queue_size)
+
+        self.workers: list[asyncio.Task] = []
+        self.completed: list[StudentEntry] = []
+        self.failed: list[StudentEntry] = []
+        self.resumed: list[StudentEntry] = []
+        self.latencies: list[float] = []
+        self.total_cost = 0
+        self.progress_bar = None
+
+    def start(self, total: int | None = None):
+        self.progress_bar = tqdm(total=total, desc="Submissions")
+        # forking this process is unsafe once it runs threads, so render workers come from a fork server
+        self.render_pool = ProcessPoolExecutor(
+            max_workers=self.render_workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        # one authorized Drive client shared by all upload workers
+        self.drive_service = DriveService()
+        self.sheets_service = SheetsService()
+        self.firestore_writer = FirestoreWriter()
+        self.firestore_writer.start()
+        journal_config = config["journal"]
+        if journal_config["enabled"]:
+            self.journal = Journal(journal_config["path"], journal_config["retention"], journal_config["stale_after"])
+        stages = [
+            (self.analyze, self.analyze_queue, self.render_queue, self.max_in_flight),
+            (self.render, self.render_queue, self.upload_queue, self.render_workers),
+            (self.upload, self.upload_queue, self.mark_queue, self.upload_workers),
+            (self.mark, self.mark_queue, None, 1),
+        ]
+        for stage, inbox, outbox, n_workers in stages:
+            for _ in range(n_workers):
+                self.workers.append(asyncio.create_task(self._worker(stage, inbox, outbox)))
+
+    async def submit(self, entry: StudentEntry):
+        await self.in_flight.acquire()
+        job = Job(entry)
+        if self.journal is not None:
+            try:
+                job.checkpoint = await asyncio.to_thread(self.journal.load, entry.row_index, entry.content_hash)
+            except Exception as e:
+                tqdm.write(f"Warning: Failed to read the journal for {entry.student_email}: {e!r}")
+            job.resumed_after = job.checkpoint.stage
+            if job.resumed_after is not None:
+                job.span.attributes["resumed_after"] = job.resumed_after
+                self.resumed.append(entry)
+        await self.analyze_queue.put(job)
+
+    async def join(self):
+        for queue in (self.analyze_queue, self.render_queue, self.upload_queue, self.mark_queue):
+            await queue.join()
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        if self.render_pool:
+            self.render_pool.shutdown()
+            self.render_pool = None
+
+        if self.firestore_writer:
+            await self.firestore_writer.close()
+
+        if self.sheets_service:
+            try:
+                await asyncio.to_thread(self.sheets_service.close)
+            except Exception as e:
+                self.marks_flushed = False
+                tqdm.write(f"Warning: Failed to mark completed rows in the sheet: {e!r}")
+
+        if self.journal:
+            await self._close_journal()
+
+        if self.progress_bar is not None:
+            self.progress_bar.close()
+            self.progress_bar = None
+
+    async def _close_journal(self):
+        # rows count as marked only once the sheet write-behind buffer has flushed
+        await self._update_journal(self.completed if self.marks_flushed else [])
+        self.journal.close()
+        self.journal = None
+
+    async def _update_journal(self, marked: list[StudentEntry]):
+        try:
+            if marked:
+                keys = [(entry.row_index, entry.content_hash) for entry in marked]
+                await asyncio.to_thread(self.journal.record_marked, keys)
+            await asyncio.to_thread(self.journal.compact)
+        except Exception as e:
+            tqdm.write(f"Warning: Failed to update the journal: {e!r}")
+
+    async def take_finished(self) -> tuple[list[StudentEntry], list[StudentEntry]]:
+        # For a long-lived pipeline: flushes the sheet marks, records them in the
+        # journal and compacts it, then returns the submissions finished so far
+        # and forgets them (and their latencies) so they can be freed.
+        n_completed = len(self.completed)
+        try:
+            await asyncio.to_thread(self.sheets_service.flush)
+        except Exception as e:
+            tqdm.write(f"Warning: Failed to mark completed rows in the sheet: {e!r}")
+            return [], []
+
+        # entries that finished during the flush may have marks still buffered
+        completed, self.completed = self.completed[:n_completed], self.completed[n_completed:]
+        failed, self.failed = self.failed, []
+        self.latencies = []
+        if self.journal is not None:
+            await self._update_journal(completed)
+        return completed, failed
+
+    async def run(self, entries: list[StudentEntry]):
+        self.start(len(entries))
+        for entry in entries:
+            await self.submit(entry)
+        await self.join()
+
+    async def analyze(self, job: Job):
+        if job.checkpoint.analysis is not None:
+            # its Firestore documents were submitted by the run that analyzed it
+            job.entry.restore_analysis(job.checkpoint.analysis)
+            return
+
+        await job.entry.analyze()
+        for essay in job.entry.essays:
+            self.firestore_writer.submit(essay.firestore_instructions())
+        await self._checkpoint(Journal.record_analysis, job, job.entry.analysis())
+
+    async def render(self, job: Job):
+        if job.checkpoint.link is not None:
+            return
+        if job.checkpoint.report is not None:
+            job.report, job.checkpoint.report = job.checkpoint.report, None
+            return
+
+        loop = asyncio.get_running_loop()
+        job.report = await loop.run_in_executor(self.render_pool, render_report, job.entry.report_data())
+        await self._checkpoint(Journal.record_report, job, job.report)
+
+    async def upload(self, job: Job):
+        if job.checkpoint.link is not None:
+            job.link = job.checkpoint.link
+            return
+
+        job.link = await asyncio.to_thread(
+            self.drive_service.upload_word_doc, job.entry.document_name, job.report
+        )
+        job.report = None
+        await self._checkpoint(Journal.record_link, job, job.link)
+
+    async def mark(self, job: Job):
+        await asyncio.to_thread(job.entry.update_completed, job.link, self.sheets_service)
+
+    async def _checkpoint(self, record, job: Job, value):
+        # a failed checkpoint only costs the resume, so it doesn't fail the submission
+        if self.journal is None:
+            return
+        try:
+            await asyncio.to_thread(record, self.journal, job.entry.row_index, job.entry.content_hash, value)
+        except Exception as e:
+            tqdm.write(f"Warning: Failed to checkpoint {job.entry.student_email}: {e!r}")
+
+    async def _worker(self, stage, inbox: asyncio.Queue, outbox: asyncio.Queue | None):
+        while True:
+            job = await inbox.get()
+            try:
+                with Span(stage.__name__, parent=job.span):
+                    await stage(job)
+            except Exception as e:
+                self._finish(job, e)
+            else:
+                if outbox is not None:
+                    await outbox.put(job)
+                else:
+                    self._finish(job)
+            finally:
+                inbox.task_done()
+
+    def _finish(self, job: Job, error: Exception | None = None):
+        job.report = None
+        entry = job.entry
+        # completions restored from the journal were paid for by an earlier run
+        cost = 0 if job.checkpoint.analysis is not None else entry.processing_costs
+        job.span.finish(status="failed" if error else "ok", cost=cost)
+        if error is None:
+            self.completed.append(entry)
+            self.total_cost += cost
+            elapsed = time.time() - job.started_at
+            self.latencies.append(elapsed)
+            resumed = f", resumed after {job.resumed_after}" if job.resumed_after else ""
+            tqdm.write(
+                f"Processed submission for {entry.student_email} "
+                f"({float_to_dollar(cost)}, {elapsed:.1f}s{resumed})"
+            )
+        else:
+            self.failed.append(entry)
+            tqdm.write(f"Warning: Failed to process submission for {entry.student_email}: {error!r}")
+
+        if self.progress_bar is not None:
+            self.progress_bar.update(1)
+        self.in_flight.release()
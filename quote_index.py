@@ -0,0 +1,118 @@
+CHARACTER_FOLDS = str.maketrans({
+    "‘": "'",
+    "’": "'",
+    "“": '"',
+    "”": '"',
+    "–": "-",
+    "—": "-",
+})
+
+# share of a quote's characters that must match before it counts as found;
+# below it the longest common substring is a few stray letters
+MIN_MATCH_RATIO = 0.6
+
+
+def normalize(text: str) -> tuple[str, list[int]]:
+    # Lowercases, folds curly quotes and collapses whitespace runs to one space.
+    # Returns the normalized text and, for every normalized character, the
+    # index of the character it came from in `text`.
+    chars: list[str] = []
+    offsets: list[int] = []
+    previous_space = False
+    for i, c in enumerate(text.translate(CHARACTER_FOLDS)):
+        if c.isspace():
+            if previous_space:
+                continue
+            c = " "
+            previous_space = True
+        else:
+            previous_space = False
+            lowered = c.lower()
+            c = lowered if len(lowered) == 1 else c
+        chars.append(c)
+        offsets.append(i)
+    return "".join(chars), offsets
+
+
+class QuoteIndex:
+    # Suffix automaton over the normalized essay text. Built once per essay in
+    # O(len(text)); each lookup finds the longest common substring between a
+    # quote and the text in O(len(quote)).
+    def __init__(self, text: str):
+        self.text = text
+        self.normalized, self.offsets = normalize(text)
+
+        self.next: list[dict[str, int]] = [{}]
+        self.link: list[int] = [-1]
+        self.length: list[int] = [0]
+        # end position (in the normalized text) of the first occurrence of each state's strings
+        self.first_end: list[int] = [-1]
+
+        last = 0
+        for i, c in enumerate(self.normalized):
+            last = self._extend(last, c, i)
+
+    def _add_state(self, length: int, link: int, first_end: int, transitions: dict[str, int]) -> int:
+        self.next.append(transitions)
+        self.link.append(link)
+        self.length.append(length)
+        self.first_end.append(first_end)
+        return len(self.length) - 1
+
+    def _extend(self, last: int, c: str, position: int) -> int:
+        current = self._add_state(self.length[last] + 1, -1, position, {})
+        p = last
+        while p != -1 and c not in self.next[p]:
+            self.next[p][c] = current
+            p = self.link[p]
+
+        if p == -1:
+            self.link[current] = 0
+            return current
+
+        q = self.next[p][c]
+        if self.length[p] + 1 == self.length[q]:
+            self.link[current] = q
+            return current
+
+        clone = self._add_state(self.length[p] + 1, self.link[q], self.first_end[q], dict(self.next[q]))
+        while p != -1 and self.next[p].get(c) == q:
+            self.next[p][c] = clone
+            p = self.link[p]
+        self.link[q] = clone
+        self.link[current] = clone
+        return current
+
+    def longest_match(self, quote: str) -> tuple[int, int]:
+        # (start, length) of the longest common substring in the normalized text;
+        # ties go to the earliest occurrence
+        state, length = 0, 0
+        best_length, best_end = 0, -1
+        for c in normalize(quote)[0]:
+            while state and c not in self.next[state]:
+                state = self.link[state]
+                length = self.length[state]
+            if c in self.next[state]:
+                state = self.next[state][c]
+                length += 1
+
+            if length > best_length or (length == best_length and self.first_end[state] < best_end):
+                best_length, best_end = length, self.first_end[state]
+        return best_end - best_length + 1, best_length
+
+    def find(self, quote: str, min_ratio: float = MIN_MATCH_RATIO) -> tuple[int, int] | None:
+        # Best (start, end) span of `quote` in the original text, ignoring case and
+        # whitespace differences, or None if the match covers less than min_ratio
+        # of the normalized quote.
+        start, length = self.longest_match(quote)
+        end = start + length
+
+        while start < end and self.normalized[start] == " ":
+            start += 1
+        while end > start and self.normalized[end - 1] == " ":
+            end -= 1
+        quote_length = len(normalize(quote)[0].strip())
+        if end == start or end - start < min_ratio * quote_length:
+            return None
+
+        return self.offsets[start], self.offsets[end - 1] + 1
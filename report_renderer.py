@@ -0,0 +1,80 @@
+import io
+
+from config import config
+
+# (label, field) pairs; the template holds a "{field}" run after each bold label
+FIELDS = [
+    ("Student Email: ", "student_email"),
+    ("Parent Email: ", "parent_email"),
+    ("Middle School: ", "middle_school"),
+    ("GPA: ", "gpa"),
+    ("Date: ", "date"),
+]
+
+# loaded once per process, so each worker in the render pool reads the file once
+_template: bytes | None = None
+
+
+def load_template() -> bytes:
+    global _template
+    if _template is None:
+        with open(config["report"]["template_path"], "rb") as f:
+            _template = f.read()
+    return _template
+
+
+def fill_fields(document, fields: dict):
+    placeholders = {"{" + field + "}": str(fields.get(field, "")) for _, field in FIELDS}
+    for paragraph in document.paragraphs:
+        for run in paragraph.runs:
+            if run.text in placeholders:
+                run.text = placeholders[run.text]
+
+
+def write_essay(document, number: int, section: dict):
+    prompt_paragraph = document.add_paragraph()
+    prompt_run = prompt_paragraph.add_run(f"Prompt {number}: " + section["prompt"])
+    prompt_run.font.bold = True
+
+    # One docx paragraph per essay paragraph. A run that crosses a paragraph
+    # break is split, and its comments are attached to the first piece.
+    text = section["text"]
+    runs = section["runs"]
+    commented: set[int] = set()
+    i = 0
+    for paragraph_start, paragraph_end in section["paragraphs"]:
+        paragraph = document.add_paragraph()
+        while i < len(runs) and runs[i][1] <= paragraph_start:
+            i += 1
+
+        for j in range(i, len(runs)):
+            start, end, comments = runs[j]
+            if start >= paragraph_end:
+                break
+
+            new_run = paragraph.add_run(text[max(start, paragraph_start): min(end, paragraph_end)])
+            if j not in commented:
+                for comment in comments:
+                    new_run.add_comment(comment, author="EduAvenues", initials="EA")
+                commented.add(j)
+
+    for comment in section["general_comments"]:
+        document.add_paragraph("\n" + comment + "\n")
+
+    document.add_page_break()
+
+
+def render_report(report: dict) -> bytes:
+    # Runs in the render process pool: takes plain data from
+    # StudentEntry.report_data() and returns the serialized .docx.
+    from docx import Document
+
+    document = Document(io.BytesIO(load_template()))
+    fill_fields(document, report["fields"])
+
+    for number, section in enumerate(report["essays"], start=1):
+        write_essay(document, number, section)
+
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
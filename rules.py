@@ -0,0 +1,44 @@
+import json
+import re
+from functools import lru_cache
+
+from config import config
+
+APOSTROPHES = "'’"
+
+
+def _key(phrase: str) -> str:
+    return phrase.lower().replace("’", "'")
+
+
+class RuleMatcher:
+    # Compiles every phrase from every rule file into one regex, so an essay is
+    # scanned once no matter how many rule files there are. A rule file is
+    # either a JSON list of phrases or a JSON object mapping each phrase to a
+    # replacement; its comment template may use {match} and {replacement}.
+    def __init__(self, rule_files: list[dict]):
+        self.rules: dict[str, tuple[str, str | None]] = {}
+        for rule_file in rule_files:
+            with open(rule_file["path"], "r") as f:
+                data = json.load(f)
+
+            entries = data.items() if isinstance(data, dict) else ((phrase, None) for phrase in data)
+            for phrase, replacement in entries:
+                self.rules.setdefault(_key(phrase), (rule_file["comment"], replacement))
+
+        # longest first, so "you're" wins over "you"
+        phrases = sorted(self.rules, key=len, reverse=True)
+        alternatives = "|".join(re.escape(phrase).replace("'", f"[{APOSTROPHES}]") for phrase in phrases)
+        boundary = rf"\w{APOSTROPHES}"
+        self.pattern = re.compile(rf"(?<![{boundary}])(?:{alternatives})(?![{boundary}])", re.IGNORECASE)
+
+    def find_all(self, text: str):
+        # yields (start_index, length, comment) for every rule hit in text
+        for match in self.pattern.finditer(text):
+            comment, replacement = self.rules[_key(match.group(0))]
+            yield match.start(), len(match.group(0)), comment.format(match=match.group(0), replacement=replacement)
+
+
+@lru_cache(maxsize=None)
+def get_rule_matcher() -> RuleMatcher:
+    return RuleMatcher(config["rules"])
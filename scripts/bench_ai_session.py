@@ -0,0 +1,60 @@
+# Compares per-call latency of a fresh ClientSession per completion (the old
+# behaviour) against AIService's pooled session, using a local stub server.
+# Run from the repository root: python -m scripts.bench_ai_session
+import asyncio
+import statistics
+import sys
+import time
+
+import aiohttp
+
+from config import config
+from scripts.stub_openai_server import LatencyModel, create_app, start_server
+from services.ai_service import AIService
+
+N_CALLS = 200
+
+
+async def session_per_call(url: str) -> list[float]:
+    latencies = []
+    for _ in range(N_CALLS):
+        t0 = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            data = {"model": "gpt-3.5-turbo", "messages": [], "max_tokens": 16}
+            async with session.post(url, json=data) as response:
+                await response.json()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+async def pooled_session(url: str) -> list[float]:
+    latencies = []
+    async with AIService() as service:
+        service.url = url
+        for _ in range(N_CALLS):
+            t0 = time.perf_counter()
+            await service.generate_chat_completion("system", "prompt", "gpt-3.5-turbo", use_cache=False)
+            latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<20} mean {statistics.mean(latencies) * 1000:7.2f}ms  p50 {p50:7.2f}ms  p95 {p95:7.2f}ms")
+
+
+async def main():
+    config["ai_service"]["cache"]["enabled"] = False
+    runner, base_url = await start_server(create_app(LatencyModel("constant", 0, 0)))
+    url = base_url + "/chat/completions"
+    try:
+        report("session per call", await session_per_call(url))
+        report("pooled session", await pooled_session(url))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
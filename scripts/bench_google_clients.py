@@ -0,0 +1,55 @@
+# Measures SheetsService/DriveService construction cost. The first
+# construction builds the API client from the bundled discovery document;
+# later ones should reuse it. No network calls are made.
+# Run from the repository root: python -m scripts.bench_google_clients
+import json
+import os
+import time
+
+N_CONSTRUCTIONS = 100
+
+
+def throwaway_service_account() -> str:
+    # building clients only parses the key, so a generated one is enough offline
+    import rsa
+
+    _, private_key = rsa.newkeys(1024)
+    return json.dumps(
+        {
+            "type": "service_account",
+            "project_id": "bench",
+            "private_key_id": "bench",
+            "private_key": private_key.save_pkcs1().decode(),
+            "client_email": "bench@bench.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }
+    )
+
+
+def main():
+    if not os.environ.get("GOOGLE_SA_KEY"):
+        os.environ["GOOGLE_SA_KEY"] = throwaway_service_account()
+
+    from services import google_clients
+    from services.drive_service import DriveService
+    from services.sheets_service import SheetsService
+
+    for cls in (SheetsService, DriveService):
+        t0 = time.perf_counter()
+        cls()
+        first = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(N_CONSTRUCTIONS):
+            cls()
+        later = (time.perf_counter() - t0) / N_CONSTRUCTIONS
+
+        print(f"{cls.__name__:<14} first {first * 1000:8.2f}ms  after {later * 1e6:8.2f}us")
+
+    for (api, version), seconds in google_clients.build_times.items():
+        print(f"build({api}, {version}): {seconds * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Import-time regression check for the CLI entry point. Imports main in fresh
+# interpreters with no credentials set and fails if a heavy dependency is
+# loaded at import time or the median import takes longer than --max-ms.
+# Run from the repository root: python -m scripts.bench_import_time
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# only needed once there is work to do
+HEAVY_MODULES = ["pandas", "numpy", "docx", "googleapiclient", "firebase_admin", "aiohttp"]
+
+PROBE = (
+    "import sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - t0\n"
+    "loaded = [m for m in {heavy!r} if m in sys.modules]\n"
+    "print(elapsed, ','.join(loaded))\n"
+)
+
+
+def measure() -> tuple[float, list[str]]:
+    env = {key: value for key, value in os.environ.items() if not key.endswith("_SA_KEY")}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(output[0]), output[1].split(",") if len(output) > 1 else []
+
+
+def slowest_imports(n: int) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], capture_output=True, text=True, check=True
+    ).stderr
+    imports = []
+    for line in stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    times = []
+    loaded: set[str] = set()
+    for _ in range(args.runs):
+        elapsed, modules = measure()
+        times.append(elapsed * 1000)
+        loaded.update(modules)
+
+    median = statistics.median(times)
+    print(f"import main: median {median:.0f}ms, min {min(times):.0f}ms, max {max(times):.0f}ms ({args.runs} runs)")
+    print("slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(8):
+        print(f"  {cumulative / 1000:7.1f}ms  {name}")
+
+    failures = []
+    if loaded:
+        failures.append("heavy modules loaded at import: " + ", ".join(sorted(loaded)))
+    if median > args.max_ms:
+        failures.append(f"median import time {median:.0f}ms exceeds {args.max_ms:.0f}ms")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Compares anchoring model quotes with utils.longest_common_substring against
+# QuoteIndex on a long synthetic essay.
+# Run from the repository root: python -m scripts.bench_quote_index
+import random
+import time
+
+from quote_index import QuoteIndex
+from utils import longest_common_substring
+
+WORDS = (
+    "the problem asked us to find the number of ways to arrange seven books on a shelf "
+    "so first I counted the arrangements where two books are next to each other and then "
+    "I subtracted that from the total which gave me the answer after checking small cases"
+).split()
+
+ESSAY_CHARS = 6000
+N_QUOTES = 20
+
+
+def synthetic_essay() -> str:
+    paragraphs = []
+    length = 0
+    while length < ESSAY_CHARS:
+        paragraph = " ".join(random.choices(WORDS, k=random.randint(60, 120))).capitalize() + "."
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 1
+    return "\n".join(paragraphs)
+
+
+def synthetic_quotes(essay: str) -> list[str]:
+    quotes = []
+    for i in range(N_QUOTES):
+        start = random.randrange(len(essay) - 80)
+        quote = essay[start: start + random.randint(20, 80)]
+        if i % 3 == 1:
+            # the model often changes case and whitespace
+            quote = quote.upper().replace(" ", "  ")
+        elif i % 3 == 2:
+            # or quotes loosely
+            quote = "I think " + quote[5:] + " etc"
+        quotes.append(f'"{quote}"')
+    return quotes
+
+
+def main():
+    random.seed(0)
+    essay = synthetic_essay()
+    quotes = synthetic_quotes(essay)
+
+    t0 = time.perf_counter()
+    for quote in quotes:
+        longest_common_substring(quote, essay)
+    lcs_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index = QuoteIndex(essay)
+    build_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for quote in quotes:
+        index.find(quote)
+    query_time = time.perf_counter() - t0
+
+    print(f"essay: {len(essay)} chars, {len(quotes)} quotes")
+    print(f"longest_common_substring: {lcs_time * 1000:9.2f}ms total")
+    print(f"QuoteIndex build:         {build_time * 1000:9.2f}ms")
+    print(f"QuoteIndex queries:       {query_time * 1000:9.2f}ms total")
+    print(f"speedup:                  {lcs_time / (build_time + query_time):9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
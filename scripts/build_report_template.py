@@ -0,0 +1,43 @@
+# Builds the .docx template that report_renderer fills in for every submission:
+# the title, the labelled submission fields and the branded footer.
+# Run from the repository root: python -m scripts.build_report_template
+from docx import Document
+from docx.shared import Pt, RGBColor
+
+from config import config
+from report_renderer import FIELDS
+
+
+def build_template(path: str):
+    document = Document()
+    title = document.add_paragraph()
+    title_run = title.add_run("EduAvenues/TJTestPrep Essay Feedback")
+    title_run.font.color.rgb = RGBColor.from_string("018AFD")
+    title_run.font.size = Pt(16)
+    title_run.font.bold = True
+    title.alignment = 1  # centers the title
+
+    for label, field in FIELDS:
+        paragraph = document.add_paragraph()
+        label_run = paragraph.add_run(label)
+        label_run.font.bold = True
+        paragraph.add_run("{" + field + "}")
+
+    footer = document.sections[0].footer
+
+    paragraph = footer.paragraphs[0]
+
+    left_part = paragraph.add_run("© EduAvenues LLC\t\t")
+    left_part.font.color.rgb = RGBColor.from_string("018AFD")
+
+    # Set the right side of the footer
+    right_part = paragraph.add_run("EduAvenues")
+    right_part.font.color.rgb = RGBColor.from_string("018AFD")
+    right_part.font.name = "Avenir"
+    right_part.font.size = Pt(14)
+
+    document.save(path)
+
+
+if __name__ == "__main__":
+    build_template(config["report"]["template_path"])
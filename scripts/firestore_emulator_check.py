@@ -0,0 +1,58 @@
+# Writes synthetic essays through FirestoreWriter and reads them back, to check
+# batching and retries against the local Firestore emulator:
+#   gcloud emulators firestore start --host-port=localhost:8081
+#   FIRESTORE_EMULATOR_HOST=localhost:8081 python -m scripts.firestore_emulator_check --essays 300
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+
+def instructions_for(essay_id: str, n_comments: int) -> list[dict]:
+    instructions = [{"path": ["essays", essay_id], "data": {"essay_text": "emulator check"}}]
+    for i in range(n_comments):
+        instructions.append(
+            {"path": ["essays", essay_id, "quoted_comments", str(i)], "data": {"comment": f"comment {i}"}}
+        )
+    return instructions
+
+
+async def write(n_essays: int, n_comments: int):
+    from services.firestore_writer import FirestoreWriter
+
+    writer = FirestoreWriter()
+    writer.start()
+    for i in range(n_essays):
+        writer.submit(instructions_for(f"emulator-check-{i}", n_comments))
+    await writer.close()
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--essays", type=int, default=300)
+    parser.add_argument("--comments", type=int, default=5)
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST is not set; refusing to write to a real project.")
+
+    t0 = time.time()
+    writer = asyncio.run(write(args.essays, args.comments))
+    elapsed = time.time() - t0
+
+    from firebase_admin import firestore
+
+    from services.firestore_service import get_app
+
+    essays = list(firestore.client(get_app()).collection("essays").list_documents())
+    expected = args.essays * (args.comments + 1)
+    print(f"{writer.written}/{expected} writes committed, {writer.failed} failed, in {elapsed:.2f}s")
+    print(f"{len(essays)} essay documents in the emulator")
+    if writer.written != expected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
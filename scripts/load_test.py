@@ -0,0 +1,214 @@
+# End-to-end load test: runs main()'s full pipeline against the local stub
+# OpenAI server with synthetic spreadsheet rows. Google Sheets, Drive and
+# Firestore are replaced with in-memory fakes before anything imports them.
+# Run from the repository root: python -m scripts.load_test --submissions 200
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+from config import config
+from scripts.stub_openai_server import create_app, latency_from_args, start_server
+from utils import column_index
+
+WORDS = (
+    "science robot team project problem solve learn school community build code design "
+    "experiment data idea challenge friend teacher summer club math result improve"
+).split()
+RULE_WORDS = ["don't", "can't", "you", "yourself", "it's", "wouldn't"]
+
+SPS_PROMPTS = ["Describe a time you solved a problem.", "Why do you want to attend TJ?"]
+PSE_PROMPTS = ["Explain how you would solve the following problem."]
+
+
+def fake_sentence() -> str:
+    words = random.choices(WORDS, k=random.randint(8, 18))
+    if random.random() < 0.3:
+        words.insert(random.randrange(len(words)), random.choice(RULE_WORDS))
+    return " ".join(words).capitalize() + "."
+
+
+def fake_essay() -> str:
+    paragraphs = [" ".join(fake_sentence() for _ in range(random.randint(3, 7))) for _ in range(random.randint(2, 4))]
+    return "\n".join(paragraphs)
+
+
+def fake_sheet(n_rows: int) -> tuple[list[str], list[list[str]]]:
+    spreadsheet = config["spreadsheet"]
+    essay_headers = [spreadsheet["sps_start_indicator"] + p for p in SPS_PROMPTS]
+    essay_headers += [spreadsheet["pse_start_indicator"] + p for p in PSE_PROMPTS]
+
+    metadata_columns = [
+        spreadsheet[key]
+        for key in (
+            "completed_column",
+            "document_link_column",
+            "student_email_column",
+            "parent_email_column",
+            "reported_gpa_column",
+            "middle_school_column",
+        )
+    ]
+    width = max(column_index(column) for column in metadata_columns) + 1
+    header = [f"Column {i}" for i in range(width)] + essay_headers
+
+    rows = []
+    for i in range(n_rows):
+        row = [""] * len(header)
+        row[column_index(spreadsheet["completed_column"])] = "FALSE"
+        row[column_index(spreadsheet["student_email_column"])] = f"student{i}@example.com"
+        row[column_index(spreadsheet["parent_email_column"])] = f"parent{i}@example.com"
+        row[column_index(spreadsheet["reported_gpa_column"])] = "4.0"
+        row[column_index(spreadsheet["middle_school_column"])] = "Example Middle School"
+        for j in range(width, len(header)):
+            row[j] = fake_essay()
+        rows.append(row)
+    return header, rows
+
+
+class FakeGoogle:
+    # shared state behind the fake Google services
+    header: list[str] = []
+    rows: list[list[str]] = []
+    api_latency = 0.0
+    uploads: list[str] = []
+    cell_updates: list[tuple] = []
+    firestore_writes = 0
+
+
+class FakeSheetCursor:
+    next_row = config["spreadsheet"]["row_start"]
+
+    @classmethod
+    def load(cls):
+        return cls()
+
+    def advance(self, next_row):
+        pass
+
+
+class FakeSheetsService:
+    def get_header(self):
+        time.sleep(FakeGoogle.api_latency)
+        return FakeGoogle.header
+
+    def iter_row_chunks(self, start_row, width):
+        time.sleep(FakeGoogle.api_latency)
+        first_row = config["spreadsheet"]["row_start"]
+        yield start_row, FakeGoogle.rows[start_row - first_row:]
+
+    def update_cell(self, row, column, value):
+        time.sleep(FakeGoogle.api_latency)
+        FakeGoogle.cell_updates.append((row, column, value))
+
+    def queue_update(self, row, column, value):
+        FakeGoogle.cell_updates.append((row, column, value))
+
+    def flush(self):
+        time.sleep(FakeGoogle.api_latency)
+
+    def close(self):
+        self.flush()
+
+
+class FakeDriveService:
+    def upload_word_doc(self, document_name, data):
+        time.sleep(FakeGoogle.api_latency)
+        FakeGoogle.uploads.append(document_name)
+        return f"https://docs.google.com/document/d/fake-{len(FakeGoogle.uploads)}"
+
+
+class FakeFirestoreService:
+    def batch_write(self, instructions):
+        time.sleep(FakeGoogle.api_latency)
+        FakeGoogle.firestore_writes += len(instructions)
+
+
+def install_fake_google_services(header: list[str], rows: list[list[str]], api_latency: float):
+    # replaces the Google service modules so no credentials or network are needed
+    FakeGoogle.header = header
+    FakeGoogle.rows = rows
+    FakeGoogle.api_latency = api_latency
+
+    for name, attributes in (
+        ("services.sheets_service", {"SheetsService": FakeSheetsService, "SheetCursor": FakeSheetCursor}),
+        ("services.drive_service", {"DriveService": FakeDriveService}),
+        ("services.firestore_service", {"FirestoreService": FakeFirestoreService, "MAX_BATCH_SIZE": 500}),
+    ):
+        module = types.ModuleType(name)
+        for attribute, cls in attributes.items():
+            setattr(module, attribute, cls)
+        sys.modules[name] = module
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the submission pipeline against the stub server")
+    parser.add_argument("--submissions", type=int, default=50)
+    parser.add_argument("--max-in-flight", type=int, default=config["pipeline"]["max_in_flight"])
+    parser.add_argument("--google-latency", type=float, default=0.2, help="seconds per fake Google API call")
+    parser.add_argument("--latency", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.8)
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    return parser.parse_args()
+
+
+async def run(args):
+    app = create_app(latency_from_args(args), args.error_rate_429, args.error_rate_5xx)
+    runner, base_url = await start_server(app)
+
+    config["limit"] = args.submissions
+    config["pipeline"]["max_in_flight"] = args.max_in_flight
+    config["ai_service"]["base_url"] = base_url
+    output_dir = tempfile.mkdtemp()
+    config["ai_service"]["cache"]["path"] = output_dir + "/completions.sqlite3"
+    config["metrics"]["report_path"] = output_dir + "/run_report.json"
+    config["metrics"]["prometheus_path"] = output_dir + "/metrics.prom"
+    config["journal"]["path"] = output_dir + "/journal.sqlite3"
+
+    header, rows = fake_sheet(args.submissions)
+    install_fake_google_services(header, rows, args.google_latency)
+
+    import main
+
+    try:
+        t0 = time.perf_counter()
+        pipeline = await main.main()
+        elapsed = time.perf_counter() - t0
+    finally:
+        await runner.cleanup()
+
+    latencies = pipeline.latencies
+    stats = app["stats"]
+    print("\n--- load test report ---")
+    print(
+        f"submissions:       {len(pipeline.completed)} ok, {len(pipeline.failed)} failed, "
+        f"{len(FakeGoogle.uploads)} uploaded, {FakeGoogle.firestore_writes} Firestore writes"
+    )
+    print(f"wall time:         {elapsed:.2f}s")
+    print(f"throughput:        {len(pipeline.completed) / elapsed:.2f} submissions/s")
+    if latencies:
+        print(
+            f"latency:           p50 {percentile(latencies, 50):.2f}s  "
+            f"p95 {percentile(latencies, 95):.2f}s  p99 {percentile(latencies, 99):.2f}s  "
+            f"mean {statistics.mean(latencies):.2f}s"
+        )
+    print(f"llm requests:      {dict(stats.requests)}")
+    print(f"injected errors:   {dict(stats.injected_errors)}")
+    print(f"cost (reported):   ${pipeline.total_cost:.4f}")
+    print(f"cost (stub usage): ${stats.cost():.4f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,226 @@
+# A local stand-in for the OpenAI chat completions endpoint, for load tests.
+# Replies are "quote" - suggestion lines quoting the user message, so they
+# anchor in the essay like real suggestions do. Paragraphs labeled [P1], [P2]...
+# are quoted one at a time, with the label in front as packed requests ask.
+# Requests with "stream": true get server-sent events: the first token after a
+# fraction of the sampled latency, the rest spread over the remainder.
+# Run from the repository root: python -m scripts.stub_openai_server --port 8080
+# and set OPENAI_BASE_URL=http://127.0.0.1:8080/v1
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+from config import pricing
+
+CHARS_PER_TOKEN = 4
+LABEL = re.compile(r"^(\[P\d+\]) (.*)$", re.MULTILINE)
+TOKENS_PER_SUGGESTION = 40
+TTFT_FRACTION = 0.25
+
+SUGGESTIONS = [
+    "Be more specific about what you learned here.",
+    "Consider showing this with an example instead of stating it.",
+    "This sentence could be tightened; cut the filler words.",
+    "Connect this back to the prompt.",
+    "Change the verb tense to stay consistent.",
+]
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class LatencyModel:
+    def __init__(self, distribution: str, mean: float, spread: float):
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+
+    def sample(self) -> float:
+        if self.distribution == "constant":
+            return self.mean
+        if self.distribution == "uniform":
+            return max(0.0, random.uniform(self.mean - self.spread, self.mean + self.spread))
+        if self.distribution == "lognormal":
+            # mean is the median, spread is sigma of the underlying normal
+            return random.lognormvariate(math.log(self.mean), self.spread)
+        raise ValueError(f"Unknown latency distribution: {self.distribution}")
+
+
+class StubStats:
+    def __init__(self):
+        self.requests: defaultdict[str, int] = defaultdict(int)
+        self.prompt_tokens: defaultdict[str, int] = defaultdict(int)
+        self.completion_tokens: defaultdict[str, int] = defaultdict(int)
+        self.injected_errors: defaultdict[int, int] = defaultdict(int)
+
+    def cost(self) -> float:
+        total = 0.0
+        for model in self.requests:
+            model_pricing = pricing.get(model, pricing["gpt-4"])
+            total += model_pricing["prompt_tokens"] * self.prompt_tokens[model] / 1000
+            total += model_pricing["completion_tokens"] * self.completion_tokens[model] / 1000
+        return total
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "prompt_tokens": dict(self.prompt_tokens),
+            "completion_tokens": dict(self.completion_tokens),
+            "injected_errors": dict(self.injected_errors),
+            "cost": self.cost(),
+        }
+
+
+def fake_completion(prompt: str, max_tokens: int) -> str:
+    paragraphs = [(label + " ", text.split()) for label, text in LABEL.findall(prompt)]
+    if not paragraphs:
+        paragraphs = [("", prompt.split())]
+    n_suggestions = max(1, min(5 * len(paragraphs), max_tokens // TOKENS_PER_SUGGESTION))
+    lines = []
+    for _ in range(n_suggestions):
+        label, words = random.choice(paragraphs)
+        if len(words) < 4:
+            continue
+        length = random.randint(3, min(8, len(words)))
+        start = random.randrange(len(words) - length + 1)
+        quote = " ".join(words[start: start + length])
+        lines.append(f'{label}"{quote}" - {random.choice(SUGGESTIONS)}')
+    return "\n".join(lines) or random.choice(SUGGESTIONS)
+
+
+async def stream_completion(
+    request: web.Request, model: str, completion: str, usage: dict | None, delay: float
+) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    chunk_id = f"chatcmpl-stub-{time.time_ns()}"
+
+    async def send(choices: list[dict], **extra):
+        chunk = {"id": chunk_id, "object": "chat.completion.chunk", "model": model, "choices": choices, **extra}
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+    pieces = re.findall(r"\S+\s*|\s+", completion)
+    interval = delay * (1 - TTFT_FRACTION) / max(len(pieces), 1)
+    for i, piece in enumerate(pieces):
+        if i:
+            await asyncio.sleep(interval)
+        await send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+    await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if usage is not None:
+        await send([], usage=usage)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def create_app(
+    latency: LatencyModel,
+    error_rate_429: float = 0.0,
+    error_rate_5xx: float = 0.0,
+) -> web.Application:
+    stats = StubStats()
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        data = await request.json()
+        model = data.get("model", "")
+
+        delay = latency.sample()
+        stream = bool(data.get("stream"))
+        await asyncio.sleep(delay * TTFT_FRACTION if stream else delay)
+
+        roll = random.random()
+        if roll < error_rate_429:
+            stats.injected_errors[429] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status=429,
+                headers={"Retry-After": "1", "x-ratelimit-reset-requests": "1s"},
+            )
+        if roll < error_rate_429 + error_rate_5xx:
+            stats.injected_errors[503] += 1
+            return web.json_response({"error": {"message": "Service unavailable"}}, status=503)
+
+        messages = data.get("messages", [])
+        user_message = messages[-1]["content"] if messages else ""
+        completion = fake_completion(user_message, data.get("max_tokens", 256))
+
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        completion_tokens = count_tokens(completion)
+        stats.requests[model] += 1
+        stats.prompt_tokens[model] += prompt_tokens
+        stats.completion_tokens[model] += completion_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+        if stream:
+            include_usage = data.get("stream_options", {}).get("include_usage", False)
+            return await stream_completion(request, model, completion, usage if include_usage else None, delay)
+
+        return web.json_response(
+            {
+                "id": f"chatcmpl-stub-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": completion},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats.to_dict())
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+async def start_server(app: web.Application, host: str = "127.0.0.1", port: int = 0):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/v1"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.8, help="seconds (the median for lognormal)")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def latency_from_args(args) -> LatencyModel:
+    return LatencyModel(args.latency, args.latency_mean, args.latency_spread)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    app = create_app(latency_from_args(args), args.error_rate_429, args.error_rate_5xx)
+    web.run_app(app, host=args.host, port=args.port)
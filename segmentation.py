@@ -0,0 +1,66 @@
+import re
+from functools import cached_property
+
+from quote_index import QuoteIndex
+
+SENTENCE_END = re.compile(r"[.!?]+[\"'”’)\]]*(?=\s|$)")
+
+
+def clean(raw: str) -> str:
+    # strips the text and collapses runs of spaces in one pass
+    chars: list[str] = []
+    for c in raw.strip():
+        if c == " " and chars and chars[-1] == " ":
+            continue
+        chars.append(c)
+    return "".join(chars)
+
+
+def _strip_span(text: str, start: int, end: int) -> tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+class Segmentation:
+    # The cleaned essay text with its paragraph boundaries, and sentence
+    # boundaries on demand, as (start, end) offsets into the cleaned text. Built
+    # once per essay and shared by the comment generators, quote anchoring and
+    # the report.
+    def __init__(self, raw: str):
+        self.text = clean(raw)
+
+        self.paragraphs: list[tuple[int, int]] = []
+        line_start = 0
+        for line in self.text.split("\n"):
+            start, end = _strip_span(self.text, line_start, line_start + len(line))
+            if start < end:
+                self.paragraphs.append((start, end))
+            line_start += len(line) + 1
+
+    @cached_property
+    def sentences(self) -> list[tuple[int, int]]:
+        sentences: list[tuple[int, int]] = []
+        for paragraph_start, paragraph_end in self.paragraphs:
+            sentence_start = paragraph_start
+            for match in SENTENCE_END.finditer(self.text, paragraph_start, paragraph_end):
+                sentences.append(_strip_span(self.text, sentence_start, match.end()))
+                sentence_start = match.end()
+            start, end = _strip_span(self.text, sentence_start, paragraph_end)
+            if start < end:
+                sentences.append((start, end))
+        return sentences
+
+    @cached_property
+    def paragraph_texts(self) -> list[str]:
+        return [self.text[start:end] for start, end in self.paragraphs]
+
+    @cached_property
+    def quote_index(self) -> QuoteIndex:
+        return QuoteIndex(self.text)
+
+    def release_quote_index(self):
+        # the automaton takes a few MB per essay and is only needed while comments are anchored
+        self.__dict__.pop("quote_index", None)
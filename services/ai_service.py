@@ -1,19 +1,279 @@
 import asyncio
+import json
+import math
 import os
+import re
+import statistics
+import time
+from collections import defaultdict, deque
 
 import aiohttp
-from aiolimiter import AsyncLimiter
 
-from config import pricing
+from config import config, pricing, rate_limits
+from metrics import Span, increment, observe
+from services.completion_cache import CompletionCache
+from services.completion_stream import CompletionStream, iter_sse_data
+from services.retry_policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryableError,
+    RetryPolicy,
+    RetryStats,
+    parse_retry_after,
+)
+from tokens import count_tokens
 
 DEFAULT_MAX_TOKENS = 256
 DEFAULT_TEMPERATURE = 0.7
 
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+MIN_RATE_SCALE = 0.1
+RATE_SCALE_DECREASE = 0.5
+RATE_SCALE_INCREASE = 0.05
+TYPICAL_TOKENS_WEIGHT = 0.1
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# most recent streams per model kept for stream_summary()
+STREAM_TIMING_WINDOW = 1000
+
+
+def estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    # the API counts max_tokens against the token budget when a request is admitted
+    prompt_chars = sum(len(message["content"]) for message in messages)
+    prompt_tokens = math.ceil(prompt_chars / CHARS_PER_TOKEN) + TOKENS_PER_MESSAGE * len(messages)
+    return prompt_tokens + max_tokens
+
+
+def parse_reset_duration(value: str | None) -> float | None:
+    # rate limit reset headers look like "20ms", "1s" or "6m0s"
+    if not value:
+        return None
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def _int_header(headers, name: str) -> int | None:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    def refill(self, scale: float = 1.0):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        self.refill(scale)
+        amount = min(amount, self.per_minute)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / (self.rate * scale)
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.per_minute)
+
+
+class ModelBudget:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # fraction of the nominal refill rate currently in use, lowered on 429s
+        self.scale = 1.0
+        self.last_decrease = float("-inf")
+        self.paused_until = 0.0
+        # moving average of the tokens requests are admitted with, for delay()
+        self.typical_tokens = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> float:
+        # the lock makes callers queue in arrival order instead of racing for refills;
+        # returns when the request was admitted, for record_rate_limited
+        async with self.lock:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                wait = max(
+                    pause,
+                    self.requests.wait_time(1, self.scale),
+                    self.tokens.wait_time(tokens, self.scale),
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.typical_tokens += TYPICAL_TOKENS_WEIGHT * (tokens - self.typical_tokens)
+            return time.monotonic()
+
+    def delay(self) -> float:
+        # seconds until another typical request could be admitted
+        return max(
+            self.paused_until - time.monotonic(),
+            self.requests.wait_time(1, self.scale),
+            self.tokens.wait_time(self.typical_tokens, self.scale),
+        )
+
+    def record_success(self, headers):
+        self.scale = min(1.0, self.scale + RATE_SCALE_INCREASE)
+        self.sync(headers)
+
+    def record_rate_limited(self, headers, admitted_at: float):
+        # Concurrent requests sent in the same window all come back 429 together,
+        # so the rate is only lowered again by requests admitted after the last
+        # decrease. Only a bucket the server reports as exhausted (no requests or
+        # tokens remaining, or a reset time without a remaining count) is drained.
+        now = time.monotonic()
+        if admitted_at >= self.last_decrease:
+            self.scale = max(MIN_RATE_SCALE, self.scale * RATE_SCALE_DECREASE)
+            self.last_decrease = now
+
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = _int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining == 0 or (remaining is None and headers.get(f"x-ratelimit-reset-{kind}")):
+                bucket.refill(self.scale)
+                bucket.level = 0
+        self.sync(headers)
+
+        reset = max(
+            parse_reset_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+            parse_reset_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+        )
+        self.paused_until = max(self.paused_until, time.monotonic() + reset)
+
+    def sync(self, headers):
+        # the server's view of the budget wins over our local estimate
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _int_header(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if limit:
+                bucket.per_minute = limit
+            if remaining is not None:
+                bucket.refill(self.scale)
+                bucket.level = min(bucket.level, remaining)
+
+
+class AdmissionController:
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.budgets: dict[str, ModelBudget] = {}
+
+    def budget(self, model: str) -> ModelBudget:
+        if model not in self.budgets:
+            limits = self.limits.get(model, self.limits["default"])
+            self.budgets[model] = ModelBudget(limits["requests"], limits["tokens"])
+        return self.budgets[model]
+
+    async def acquire(self, model: str, tokens: int) -> float:
+        return await self.budget(model).acquire(tokens)
+
+    def delay(self) -> float:
+        # how long new work would wait for the most constrained model seen so far
+        return max((budget.delay() for budget in self.budgets.values()), default=0.0)
+
+    def record_success(self, model: str, headers):
+        self.budget(model).record_success(headers)
+
+    def record_rate_limited(self, model: str, headers, admitted_at: float):
+        self.budget(model).record_rate_limited(headers, admitted_at)
+
 
 class AIService:
     def __init__(self):
         self.api_key = os.environ.get("OPENAI_API_KEY", "")
-        self.limiter = AsyncLimiter(3000, 60)
+        self.url = config["ai_service"]["base_url"].rstrip("/") + "/chat/completions"
+        self.admission = AdmissionController(rate_limits)
+        self.session: aiohttp.ClientSession | None = None
+        self.cache: CompletionCache | None = None
+
+        retry_config = config["ai_service"]["retry"]
+        self.retry_policy = RetryPolicy(
+            retry_config["max_attempts"],
+            retry_config["base_delay"],
+            retry_config["max_delay"],
+            retry_config["deadline"],
+        )
+        self.retry_stats = RetryStats()
+        self.breakers: dict[str, CircuitBreaker] = {}
+        # (ttft, latency, queue wait) of recent streams per model
+        self.stream_timings: dict[str, deque[tuple[float, float, float]]] = defaultdict(
+            lambda: deque(maxlen=STREAM_TIMING_WINDOW)
+        )
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self) -> aiohttp.ClientSession:
+        # one pooled session per run so calls reuse DNS lookups and keep-alive connections
+        if self.session is None or self.session.closed:
+            service_config = config["ai_service"]
+            connector = aiohttp.TCPConnector(
+                limit=service_config["connection_limit"],
+                limit_per_host=service_config["connection_limit_per_host"],
+                ttl_dns_cache=service_config["dns_cache_ttl"],
+                keepalive_timeout=service_config["keepalive_timeout"],
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=service_config["total_timeout"],
+                connect=service_config["connect_timeout"],
+                sock_read=service_config["read_timeout"],
+            )
+            cache_config = service_config["cache"]
+            if self.cache is None and cache_config["enabled"]:
+                self.cache = CompletionCache(cache_config["path"], cache_config["ttl"], cache_config["max_entries"])
+
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            breaker_config = config["ai_service"]["circuit_breaker"]
+            self.breakers[model] = CircuitBreaker(
+                breaker_config["window"],
+                breaker_config["failure_threshold"],
+                breaker_config["min_calls"],
+                breaker_config["cooldown"],
+            )
+        return self.breakers[model]
 
     def compute_cost(self, base_model, prompt_tokens, completion_tokens):
         prompt_price_per_1k = pricing[base_model]["prompt_tokens"]
@@ -24,11 +284,88 @@ class AIService:
         )
         return cost
 
-    async def generate_chat_completion(self, system_message, prompt, model, **kwargs):
+    def stream_summary(self) -> str:
+        parts = []
+        for model, timings in sorted(self.stream_timings.items()):
+            ttft = statistics.median(t for t, _, _ in timings)
+            latency = statistics.median(t for _, t, _ in timings)
+            queue_wait = statistics.median(t for _, _, t in timings)
+            parts.append(
+                f"{model} ttft p50 {ttft:.2f}s, latency p50 {latency:.2f}s, "
+                f"queue wait p50 {queue_wait:.2f}s ({len(timings)} streams)"
+            )
+        return "; ".join(parts)
+
+    async def generate_chat_completion(self, system_message, prompt, model, use_cache=True, **kwargs):
         kwargs["max_tokens"] = kwargs.get("max_tokens", DEFAULT_MAX_TOKENS)
         kwargs["temperature"] = kwargs.get("temperature", DEFAULT_TEMPERATURE)
-        await self.limiter.acquire()
-        return await self.__generate_chat_completion(system_message, prompt, model, **kwargs)
+
+        await self.open()
+        with Span("llm_call", model=model):
+            if self.cache is None or not use_cache:
+                return await self.__generate_chat_completion(system_message, prompt, model, **kwargs)
+
+            payload = {"system_message": system_message, "prompt": prompt, "model": model, **kwargs}
+            return await self.cache.get_or_compute(
+                payload,
+                lambda: self.__generate_chat_completion(system_message, prompt, model, **kwargs),
+            )
+
+    def stream_chat_completion(self, system_message, prompt, model, use_cache=True, **kwargs) -> CompletionStream:
+        # Like generate_chat_completion, but the returned stream yields text as it
+        # arrives. Cached completions come back as a single delta.
+        kwargs["max_tokens"] = kwargs.get("max_tokens", DEFAULT_MAX_TOKENS)
+        kwargs["temperature"] = kwargs.get("temperature", DEFAULT_TEMPERATURE)
+
+        stream = CompletionStream(model)
+        stream.deltas = self.__trace_stream(
+            stream, self.__stream_chat_completion(stream, system_message, prompt, model, use_cache, **kwargs)
+        )
+        return stream
+
+    async def __trace_stream(self, stream: CompletionStream, deltas):
+        # The span is finished by hand: as a context manager it would stay current
+        # in the consumer's task between deltas.
+        span = Span("llm_call", model=stream.model, stream=True).start()
+        try:
+            async for delta in deltas:
+                yield delta
+        except BaseException as e:
+            span.finish(error=type(e).__name__)
+            raise
+        span.finish(cached=stream.cached)
+        if stream.ttft is not None:
+            observe("llm_ttft_seconds", stream.ttft, model=stream.model)
+        if stream.sent_at is not None:
+            observe("llm_queue_wait_seconds", stream.queue_wait, model=stream.model)
+
+    def __record_usage(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float):
+        increment("llm_requests", model=model)
+        increment("llm_tokens", prompt_tokens, model=model, kind="prompt")
+        increment("llm_tokens", completion_tokens, model=model, kind="completion")
+        increment("llm_cost_dollars", cost, model=model)
+
+    def __check_breaker(self, model: str, breaker: CircuitBreaker):
+        try:
+            breaker.check()
+        except CircuitOpenError:
+            self.retry_stats.record_rejected(model)
+            raise
+
+    async def __retry_or_raise(
+        self, model: str, breaker: CircuitBreaker, attempt: int, deadline: float, error: RetryableError
+    ):
+        # 429s are handled by the admission controller and don't count as provider failures
+        if error.reason != "429":
+            breaker.record_failure()
+
+        delay = self.retry_policy.delay(attempt, error.retry_after)
+        if attempt >= self.retry_policy.max_attempts or time.monotonic() + delay > deadline:
+            self.retry_stats.record_give_up(model, error.reason)
+            raise error
+
+        self.retry_stats.record_retry(model, error.reason)
+        await asyncio.sleep(delay)
 
     async def __generate_chat_completion(
         self,
@@ -37,11 +374,6 @@ class AIService:
         model: str,
         **kwargs,
     ) -> tuple[str, float]:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-        }
-
         data = {
             "model": model,
             "messages": [
@@ -51,17 +383,23 @@ class AIService:
             **kwargs,
         }
 
-        url = "https://api.openai.com/v1/chat/completions"
+        breaker = self.breaker(model)
+        deadline = time.monotonic() + self.retry_policy.deadline
+        attempt = 0
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                if response.status == 429:
-                    await asyncio.sleep(2)
-                    return await self.__generate_chat_completion(
-                        system_message, prompt, model, **kwargs
-                    )
+        while True:
+            self.__check_breaker(model, breaker)
 
-                response_data = await response.json()
+            attempt += 1
+            self.retry_stats.record_attempt(model)
+            try:
+                response_data = await self.__post_chat_completion(data)
+            except RetryableError as e:
+                await self.__retry_or_raise(model, breaker, attempt, deadline, e)
+                continue
+
+            breaker.record_success()
+            break
 
         completion = response_data["choices"][0]["message"]["content"].strip()  # type: ignore
 
@@ -69,5 +407,136 @@ class AIService:
         completion_tokens = response_data["usage"]["completion_tokens"]  # type: ignore
 
         cost = self.compute_cost(model, prompt_tokens, completion_tokens)
+        self.__record_usage(model, prompt_tokens, completion_tokens, cost)
 
         return completion, cost
+
+    async def __stream_chat_completion(
+        self,
+        stream: CompletionStream,
+        system_message: str,
+        prompt: str,
+        model: str,
+        use_cache: bool,
+        **kwargs,
+    ):
+        await self.open()
+        cache = self.cache if use_cache else None
+        payload = {"system_message": system_message, "prompt": prompt, "model": model, **kwargs}
+        if cache is not None:
+            cached = await cache.lookup(payload)
+            if cached is not None:
+                stream.cached = True
+                yield cached[0]
+                stream.latency = time.monotonic() - stream.started_at
+                return
+
+        data = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt},
+            ],
+            **kwargs,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        # Failures are retried only until the first token arrives; after that
+        # the caller has already consumed part of the reply, so they are raised.
+        breaker = self.breaker(model)
+        deadline = time.monotonic() + self.retry_policy.deadline
+        attempt = 0
+
+        while True:
+            self.__check_breaker(model, breaker)
+
+            attempt += 1
+            self.retry_stats.record_attempt(model)
+            try:
+                async for delta in self.__post_streaming_chat_completion(data, stream):
+                    yield delta
+            except RetryableError as e:
+                if stream.parts:
+                    breaker.record_failure()
+                    self.retry_stats.record_give_up(model, e.reason)
+                    raise
+                await self.__retry_or_raise(model, breaker, attempt, deadline, e)
+                continue
+
+            breaker.record_success()
+            break
+
+        stream.latency = time.monotonic() - stream.started_at
+        self.stream_timings[model].append(
+            (stream.ttft or stream.latency - stream.queue_wait, stream.latency, stream.queue_wait)
+        )
+
+        if stream.usage is not None:
+            stream.prompt_tokens = stream.usage["prompt_tokens"]
+            stream.completion_tokens = stream.usage["completion_tokens"]
+        else:
+            # servers that don't report usage for streams are billed from a local count
+            stream.prompt_tokens = sum(count_tokens(message["content"], model) for message in data["messages"])
+            stream.completion_tokens = count_tokens(stream.completion, model)
+        stream.cost = self.compute_cost(model, stream.prompt_tokens, stream.completion_tokens)
+        self.__record_usage(model, stream.prompt_tokens, stream.completion_tokens, stream.cost)
+
+        if cache is not None:
+            await cache.store(payload, stream.completion, stream.cost)
+
+    async def __send(self, session: aiohttp.ClientSession, data: dict, admitted_at: float):
+        # raises RetryableError for 429s and 5xx and records the rate limit headers
+        model = data["model"]
+        response = await session.post(self.url, json=data)
+        if response.status in RETRYABLE_STATUSES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status == 429:
+                self.admission.record_rate_limited(model, response.headers, admitted_at)
+                reset = max(
+                    parse_reset_duration(response.headers.get("x-ratelimit-reset-requests")) or 0,
+                    parse_reset_duration(response.headers.get("x-ratelimit-reset-tokens")) or 0,
+                )
+                retry_after = max(retry_after or 0, reset) or None
+            response.release()
+            raise RetryableError(str(response.status), retry_after)
+
+        response.raise_for_status()
+        self.admission.record_success(model, response.headers)
+        return response
+
+    async def __post_chat_completion(self, data: dict) -> dict:
+        model = data["model"]
+        admitted_at = await self.admission.acquire(model, estimate_tokens(data["messages"], data["max_tokens"]))
+
+        session = await self.open()
+        try:
+            async with await self.__send(session, data, admitted_at) as response:
+                return await response.json()
+        except asyncio.TimeoutError:
+            raise RetryableError("timeout")
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+            raise RetryableError("connection")
+
+    async def __post_streaming_chat_completion(self, data: dict, stream: CompletionStream):
+        model = data["model"]
+        admitted_at = await self.admission.acquire(model, estimate_tokens(data["messages"], data["max_tokens"]))
+
+        session = await self.open()
+        stream.sent_at = time.monotonic()
+        try:
+            async with await self.__send(session, data, admitted_at) as response:
+                async for event in iter_sse_data(response.content):
+                    if event == "[DONE]":
+                        break
+                    chunk = json.loads(event)
+                    if chunk.get("usage"):
+                        stream.usage = chunk["usage"]
+                    for choice in chunk.get("choices", []):
+                        delta = choice.get("delta", {}).get("content")
+                        if delta:
+                            yield delta
+        except asyncio.TimeoutError:
+            raise RetryableError("timeout")
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+            raise RetryableError("connection")
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from storage import open_sqlite
+
+
+class CompletionCache:
+    # On-disk cache of chat completions keyed by a hash of the full request
+    # payload. Entries expire after `ttl` seconds and the least recently used
+    # ones are evicted once there are more than `max_entries`.
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.cost_saved = 0.0
+
+        self.conn, self.lock = open_sqlite(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, completion TEXT NOT NULL, cost REAL NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+        self.conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl,))
+
+        self.pending: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        serialized = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> tuple[str, float] | None:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT completion, cost, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            completion, cost, created_at = row
+            if created_at < now - self.ttl:
+                self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+
+            self.conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            return completion, cost
+
+    def _put(self, key: str, completion: str, cost: float):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, completion, cost, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, completion, cost, now, now),
+            )
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    async def get_or_compute(self, payload: dict, compute) -> tuple[str, float]:
+        # Concurrent tasks asking for the same payload share one lookup and at
+        # most one computation. A hit costs nothing, so it is reported with a
+        # cost of 0 and its original cost is added to cost_saved.
+        key = self.key(payload)
+
+        if key in self.pending:
+            completion, cost = await asyncio.shield(self.pending[key])
+            self.hits += 1
+            self.cost_saved += cost
+            return completion, 0
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            cached = await asyncio.to_thread(self._get, key)
+            if cached is not None:
+                future.set_result(cached)
+                self.hits += 1
+                self.cost_saved += cached[1]
+                return cached[0], 0
+
+            completion, cost = await compute()
+            future.set_result((completion, cost))
+            self.misses += 1
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved in case no other task was waiting on it
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+
+        await asyncio.to_thread(self._put, key, completion, cost)
+        return completion, cost
+
+    async def lookup(self, payload: dict) -> tuple[str, float] | None:
+        # for streamed completions, which can't share a pending future; a hit
+        # is counted like one from get_or_compute
+        cached = await asyncio.to_thread(self._get, self.key(payload))
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cost_saved += cached[1]
+        return cached
+
+    async def store(self, payload: dict, completion: str, cost: float):
+        await asyncio.to_thread(self._put, self.key(payload), completion, cost)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,84 @@
+import time
+from typing import AsyncIterator
+
+
+async def iter_sse_data(lines: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # yields the data of each server-sent event; multi-line data is joined with "\n"
+    data: list[str] = []
+    async for raw in lines:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if line == "":
+            if data:
+                yield "\n".join(data)
+                data = []
+            continue
+        if line.startswith(":"):
+            continue
+
+        field, _, value = line.partition(":")
+        if field == "data":
+            data.append(value[1:] if value.startswith(" ") else value)
+
+    if data:
+        yield "\n".join(data)
+
+
+class LineBuffer:
+    # Turns a stream of text deltas into complete lines as soon as each "\n" arrives.
+    def __init__(self):
+        self.partial = ""
+
+    def feed(self, delta: str) -> list[str]:
+        lines = (self.partial + delta).split("\n")
+        self.partial = lines.pop()
+        return lines
+
+    def flush(self) -> str:
+        rest, self.partial = self.partial, ""
+        return rest
+
+
+class CompletionStream:
+    # One streamed chat completion, returned by AIService.stream_chat_completion.
+    # Iterate it for text deltas, or over lines() for complete lines. Once it is
+    # exhausted, `completion`, `cost`, `ttft` (seconds from sending the request
+    # that answered to its first token) and `latency` (seconds from the call to
+    # the end of the stream) are set. `queue_wait` is the part of the latency
+    # spent in admission control and retry backoff before that request was sent.
+    def __init__(self, model: str):
+        self.model = model
+        self.deltas: AsyncIterator[str] | None = None
+        self.parts: list[str] = []
+        self.usage: dict | None = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.cached = False
+        self.started_at = time.monotonic()
+        self.sent_at: float | None = None
+        self.ttft: float | None = None
+        self.latency: float | None = None
+
+    @property
+    def completion(self) -> str:
+        return "".join(self.parts).strip()
+
+    @property
+    def queue_wait(self) -> float:
+        return 0.0 if self.sent_at is None else self.sent_at - self.started_at
+
+    async def __aiter__(self):
+        async for delta in self.deltas:
+            if self.ttft is None:
+                self.ttft = time.monotonic() - (self.sent_at or self.started_at)
+            self.parts.append(delta)
+            yield delta
+
+    async def lines(self) -> AsyncIterator[str]:
+        buffer = LineBuffer()
+        async for delta in self:
+            for line in buffer.feed(delta):
+                yield line
+        rest = buffer.flush()
+        if rest:
+            yield rest
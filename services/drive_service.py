@@ -1,54 +1,57 @@
 import io
-import json
-import os
-import tempfile
-
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from concurrent.futures import ThreadPoolExecutor
 
 from config import config
+from metrics import traced
+from services.google_clients import authorized_http, get_client
 
-SCOPES = ["https://www.googleapis.com/auth/drive"]
-
-GOOGLE_SA_KEY = os.environ.get("GOOGLE_SA_KEY", "")
-
-creds = service_account.Credentials.from_service_account_info(
-    json.loads(GOOGLE_SA_KEY), scopes=SCOPES
-)
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
 
 class DriveService:
     def __init__(self):
         self.folder_id = config["folder_id"]
-        self.service = build("drive", "v3", credentials=creds)
-
-    def upload_word_doc(self, document_name, document):
-        bytes_io = io.BytesIO()
-        document.save(bytes_io)
+        self.resumable_threshold: int = config["drive"]["resumable_threshold"]
+        self.service = get_client("drive", "v3")
+
+    @traced("drive_poll")
+    def get_file_version(self, file_id: str) -> str:
+        # Drive bumps a file's version on every change, so one files.get tells
+        # whether a spreadsheet needs to be read again
+        file = (
+            self.service.files()
+            .get(fileId=file_id, fields="version,modifiedTime")
+            .execute(http=authorized_http())
+        )
+        return f"{file.get('version', '')}@{file.get('modifiedTime', '')}"
+
+    @traced("drive_upload")
+    def upload_word_doc(self, document_name: str, data: bytes) -> str:
+        from googleapiclient.http import MediaIoBaseUpload
 
         file_metadata = {"name": document_name, "parents": [self.folder_id]}
 
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(bytes_io.getvalue())
-            temp_file.flush()
+        # small reports go up in a single request; only large ones pay for a resumable session
+        media = MediaIoBaseUpload(
+            io.BytesIO(data),
+            mimetype=DOCX_MIMETYPE,
+            resumable=len(data) > self.resumable_threshold,
+        )
 
-            media = MediaFileUpload(
-                temp_file.name,
-                mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                resumable=True,
-            )
+        file = (
+            self.service.files()
+            .create(media_body=media, body=file_metadata, fields="id")
+            .execute(http=authorized_http())
+        )
 
-            file = (
-                self.service.files()
-                .create(media_body=media, body=file_metadata, fields="id")
-                .execute()
-            )
-
-            file_id = file.get("id", "")
-
-        os.unlink(temp_file.name)
+        file_id = file.get("id", "")
 
         link = f"https://docs.google.com/document/d/{file_id}"
 
         return link
+
+    def upload_word_docs(self, documents: list[tuple[str, bytes]], max_workers: int | None = None) -> list[str]:
+        # uploads (document_name, data) pairs concurrently; links come back in the same order
+        max_workers = max_workers or config["drive"]["max_upload_workers"]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda document: self.upload_word_doc(*document), documents))
@@ -1,19 +1,53 @@
 import json
 import os
+import threading
 from typing import List
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+from config import config
 
-FIRESTORE_SA_KEY = os.environ.get("FIRESTORE_SA_KEY", "")
+# Firestore commits at most this many writes per batch
+MAX_BATCH_SIZE = 500
 
-cred = credentials.Certificate(json.loads(FIRESTORE_SA_KEY))
-firebase_admin.initialize_app(cred)
+_lock = threading.Lock()
+
+
+def emulator_credential():
+    from firebase_admin import credentials
+    from google.auth.credentials import AnonymousCredentials
+
+    class EmulatorCredential(credentials.Base):
+        # the Firestore client talks to FIRESTORE_EMULATOR_HOST without real credentials
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    return EmulatorCredential()
+
+
+def get_app():
+    # Initializes the default firebase app on first use and returns the existing
+    # one afterwards, so it is safe to call from every service and script.
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+
+        sa_key = os.environ.get("FIRESTORE_SA_KEY", "")
+        if os.environ.get("FIRESTORE_EMULATOR_HOST") and not sa_key:
+            return firebase_admin.initialize_app(
+                emulator_credential(), {"projectId": config["firestore"]["emulator_project_id"]}
+            )
+        return firebase_admin.initialize_app(credentials.Certificate(json.loads(sa_key)))
 
 
 class FirestoreService:
     def __init__(self) -> None:
-        self.db = firestore.client()
+        from firebase_admin import firestore
+
+        self.db = firestore.client(get_app())
 
     def _get_collection(self, path: List[str]):
         ref = self.db
@@ -25,11 +59,12 @@ class FirestoreService:
         return ref
 
     def batch_write(self, instructions: List[dict]) -> None:
-        batch = self.db.batch()
+        for start in range(0, len(instructions), MAX_BATCH_SIZE):
+            batch = self.db.batch()
 
-        for instruction in instructions:
-            path = instruction["path"]
-            data = instruction["data"]
-            batch.set(self._get_collection(path), data)
+            for instruction in instructions[start: start + MAX_BATCH_SIZE]:
+                path = instruction["path"]
+                data = instruction["data"]
+                batch.set(self._get_collection(path), data)
 
-        batch.commit()
+            batch.commit()
@@ -0,0 +1,94 @@
+import asyncio
+
+from tqdm import tqdm
+
+from config import config
+from metrics import Span
+from services.firestore_service import MAX_BATCH_SIZE, FirestoreService
+from services.retry_policy import RetryPolicy
+
+
+class FirestoreWriter:
+    # Background task that coalesces write instructions from every essay into
+    # batches of at most 500 writes and commits them off the event loop, with
+    # bounded parallelism and retries. close() waits until everything queued
+    # has been committed or has given up.
+    def __init__(self):
+        writer_config = config["firestore"]
+        self.batch_size: int = min(writer_config["batch_size"], MAX_BATCH_SIZE)
+        self.flush_interval: float = writer_config["flush_interval"]
+        self.retry_policy = RetryPolicy(
+            writer_config["max_attempts"], writer_config["retry_delay"], writer_config["max_retry_delay"]
+        )
+        self.commit_slots = asyncio.Semaphore(writer_config["max_concurrent_commits"])
+
+        self.queue: asyncio.Queue[dict] = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+        self.commits: set[asyncio.Task] = set()
+        self.service: FirestoreService | None = None
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, instructions: list[dict]):
+        for instruction in instructions:
+            self.queue.put_nowait(instruction)
+
+    async def close(self):
+        await self.queue.join()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        if self.failed:
+            tqdm.write(f"Warning: Failed to upload {self.failed} documents to Firestore.")
+
+    async def _next_batch(self) -> list[dict]:
+        # waits for one instruction, then gathers more for up to flush_interval
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self.commit_slots.acquire()
+            task = asyncio.create_task(self._commit(batch))
+            self.commits.add(task)
+            task.add_done_callback(self.commits.discard)
+
+    async def _commit(self, batch: list[dict]):
+        try:
+            for attempt in range(1, self.retry_policy.max_attempts + 1):
+                try:
+                    with Span("firestore_commit", writes=len(batch), attempt=attempt):
+                        await asyncio.to_thread(self._batch_write, batch)
+                    self.written += len(batch)
+                    return
+                except Exception:
+                    if attempt == self.retry_policy.max_attempts:
+                        self.failed += len(batch)
+                        return
+                    await asyncio.sleep(self.retry_policy.delay(attempt))
+        finally:
+            self.commit_slots.release()
+            for _ in batch:
+                self.queue.task_done()
+
+    def _batch_write(self, batch: list[dict]):
+        # runs in a worker thread, so the client is created off the event loop too
+        if self.service is None:
+            self.service = FirestoreService()
+        self.service.batch_write(batch)
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+
+SCOPES = [
+    "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/spreadsheets",
+]
+
+# Every Google API client is built once per process from the discovery
+# documents bundled with google-api-python-client, and all of them share one
+# set of service account credentials whose token is refreshed here. The
+# Google libraries and the key are only loaded when the first client is needed.
+_lock = threading.RLock()
+_local = threading.local()
+_credentials = None
+_clients: dict[tuple[str, str], object] = {}
+
+# seconds spent building each client, for measuring startup cost
+build_times: dict[tuple[str, str], float] = {}
+
+
+def load_credentials():
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            from google.oauth2 import service_account
+
+            _credentials = service_account.Credentials.from_service_account_info(
+                json.loads(os.environ.get("GOOGLE_SA_KEY", "")), scopes=SCOPES
+            )
+        return _credentials
+
+
+def get_credentials():
+    # credentials with a valid token; expired tokens are refreshed once here
+    # rather than by every thread's transport on its next 401
+    import google_auth_httplib2
+    import httplib2
+
+    credentials = load_credentials()
+    with _lock:
+        if not credentials.valid:
+            credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+    return credentials
+
+
+def get_client(api: str, version: str):
+    key = (api, version)
+    with _lock:
+        if key not in _clients:
+            from googleapiclient.discovery import build
+
+            t0 = time.perf_counter()
+            _clients[key] = build(
+                api,
+                version,
+                credentials=load_credentials(),
+                static_discovery=True,
+                cache_discovery=False,
+            )
+            build_times[key] = time.perf_counter() - t0
+        return _clients[key]
+
+
+def authorized_http():
+    # httplib2 isn't thread-safe, so each thread executes requests over its own
+    # transport; the token is refreshed centrally before it is handed out
+    import google_auth_httplib2
+    import httplib2
+
+    credentials = get_credentials()
+    if getattr(_local, "http", None) is None:
+        _local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return _local.http
@@ -0,0 +1,136 @@
+import math
+import statistics
+from collections import Counter, defaultdict, deque
+from typing import Any, Callable
+
+from quote_index import MIN_MATCH_RATIO
+
+# a parser maps one reply line to (looks like "quote" - suggestion, anchored comment or None)
+LineParser = Callable[[str], tuple[bool, Any]]
+
+# most recent latencies per model kept for the typical last-model latency
+LATENCY_WINDOW = 1000
+
+
+class RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.accepted: Counter = Counter()
+        self.escalations: Counter = Counter()
+        self.cost = 0.0
+        # what the same calls would have cost sent straight to the route's last model
+        self.direct_cost = 0.0
+        self.latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        # first passes that were accepted, and the total latency of those accepted and of those escalated
+        self.accepted_first = 0
+        self.accepted_latency = 0.0
+        self.escalated_latency = 0.0
+
+
+class ModelRouter:
+    # Sends each request to its route's models in order, cheapest first, and
+    # escalates to the next one when the reply fails the route's checks: fewer
+    # parseable "quote" - suggestion lines than min_parsed_ratio of the expected
+    # count, or fewer than min_anchor_rate of them anchoring in the essay. A quote
+    # anchors when at least min_match_ratio of it is found. The last model's
+    # reply is always accepted. Routes live in config["routing"].
+    def __init__(self, ai_service, routes: dict):
+        self.ai_service = ai_service
+        self.routes = routes
+        self.stats: dict[str, RouteStats] = defaultdict(RouteStats)
+
+    def models(self, route: str) -> list[str]:
+        return self.routes[route]["models"]
+
+    def model(self, route: str) -> str:
+        # the first model of a route whose replies aren't checked
+        return self.models(route)[0]
+
+    def match_ratio(self, route: str) -> float:
+        return self.routes[route].get("min_match_ratio", MIN_MATCH_RATIO)
+
+    def check(self, route: str, expected: int, parsed: int, anchored: int) -> str | None:
+        # the name of the first failed check, or None when the reply is good enough
+        checks = self.routes[route]
+        if parsed < math.ceil(expected * checks.get("min_parsed_ratio", 0)):
+            return "parsed"
+        if anchored < math.ceil(parsed * checks.get("min_anchor_rate", 0)):
+            return "anchored"
+        return None
+
+    async def complete_comments(
+        self,
+        route: str,
+        system_message: str,
+        prompt: str,
+        expected: int,
+        new_parser: Callable[[], LineParser],
+        **kwargs,
+    ) -> tuple[list, float]:
+        # Returns the anchored comments of the accepted reply and the cost of every
+        # model tried. Lines are parsed as they stream in; new_parser() is called
+        # once per model so stateful parsers start fresh on escalation.
+        stats = self.stats[route]
+        stats.calls += 1
+        models = self.models(route)
+        cost = 0.0
+
+        for i, model in enumerate(models):
+            parse = new_parser()
+            comments = []
+            parsed = 0
+            # only lines with the "quote" - suggestion shape count as anchored
+            anchored = 0
+            stream = self.ai_service.stream_chat_completion(system_message, prompt, model, **kwargs)
+            async for line in stream.lines():
+                looks_parsed, comment = parse(line)
+                parsed += looks_parsed
+                anchored += looks_parsed and comment is not None
+                if comment is not None:
+                    comments.append(comment)
+
+            cost += stream.cost
+            # time spent queued for admission or retrying says nothing about the model
+            service_time = stream.latency - stream.queue_wait
+            stats.latencies[model].append(service_time)
+            if i == 0:
+                stats.direct_cost += self.ai_service.compute_cost(
+                    models[-1], stream.prompt_tokens, stream.completion_tokens
+                )
+
+            failed = None if i == len(models) - 1 else self.check(route, expected, parsed, anchored)
+            if failed is None:
+                stats.accepted[model] += 1
+                if i == 0 and len(models) > 1:
+                    stats.accepted_first += 1
+                    stats.accepted_latency += service_time
+                break
+
+            stats.escalations[f"{model}.{failed}"] += 1
+            if i == 0:
+                stats.escalated_latency += service_time
+
+        stats.cost += cost
+        return comments, cost
+
+    def summary(self) -> list[str]:
+        lines = []
+        for route, stats in sorted(self.stats.items()):
+            models = self.models(route)
+            hits = ", ".join(f"{model} {stats.accepted[model] / stats.calls:.0%}" for model in models)
+            line = f"{route}: {stats.calls} calls, accepted {hits}"
+            if len(models) > 1:
+                line += f", saved ${stats.direct_cost - stats.cost:.4f}"
+                final_latencies = stats.latencies[models[-1]]
+                if final_latencies:
+                    # first passes that were accepted avoided a typical last-model call;
+                    # escalated ones added their own latency on top of it
+                    typical = statistics.median(final_latencies)
+                    saved = typical * stats.accepted_first - stats.accepted_latency - stats.escalated_latency
+                    line += f" and {saved:.1f}s"
+                if stats.escalations:
+                    line += " (escalated: " + ", ".join(
+                        f"{reason}={count}" for reason, count in sorted(stats.escalations.items())
+                    ) + ")"
+            lines.append(line)
+        return lines
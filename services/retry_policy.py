@@ -0,0 +1,111 @@
+import math
+import random
+import time
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+
+
+class RetryableError(Exception):
+    def __init__(self, reason: str, retry_after: float | None = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, deadline: float = math.inf):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        # full jitter, so concurrent callers that failed together don't retry together
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+
+class CircuitBreaker:
+    # Opens when the failure rate over the last `window` calls reaches
+    # `failure_threshold`. After `cooldown` seconds a single probe call is let
+    # through; its outcome closes or re-opens the circuit.
+    def __init__(self, window: int, failure_threshold: float, min_calls: int, cooldown: float):
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.opened_at: float | None = None
+        self.probe_started_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self):
+        if self.opened_at is None:
+            return
+
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            raise CircuitOpenError("circuit open")
+        if self.probe_started_at is not None and now - self.probe_started_at < self.cooldown:
+            raise CircuitOpenError("circuit half-open, probe in progress")
+        self.probe_started_at = now
+
+    def record_success(self):
+        if self.opened_at is not None:
+            self.outcomes.clear()
+        self.opened_at = None
+        self.probe_started_at = None
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        if self.probe_started_at is not None:
+            self.opened_at = time.monotonic()
+            self.probe_started_at = None
+            return
+
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class RetryStats:
+    def __init__(self):
+        self.counters: Counter = Counter()
+
+    def record_attempt(self, model: str):
+        self.counters[f"attempts.{model}"] += 1
+
+    def record_retry(self, model: str, reason: str):
+        self.counters[f"retries.{model}.{reason}"] += 1
+
+    def record_give_up(self, model: str, reason: str):
+        self.counters[f"gave_up.{model}.{reason}"] += 1
+
+    def record_rejected(self, model: str):
+        self.counters[f"circuit_rejected.{model}"] += 1
+
+    def summary(self) -> str:
+        return ", ".join(f"{key}={value}" for key, value in sorted(self.counters.items()))
@@ -1,47 +1,130 @@
 import json
 import os
-
-import pandas as pd
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import threading
+import time
 
 from config import config
+from metrics import Span, traced
+from services.google_clients import authorized_http, get_client
+from services.retry_policy import RetryPolicy
+from storage import file_lock, write_atomic
+from utils import column_letter
+
+
+class SheetCursor:
+    # Persisted high-water mark: every row above next_row is known to be
+    # completed, so later runs only fetch from next_row on. Delete the file
+    # to rescan the whole sheet.
+    def __init__(self, path: str, next_row: int):
+        self.path = path
+        self.next_row = next_row
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+    @staticmethod
+    def _key() -> str:
+        return config["spreadsheet"]["spreadsheet_id"] + "!" + config["spreadsheet"]["sheet_name"]
 
-GOOGLE_SA_KEY = os.environ.get("GOOGLE_SA_KEY", "")
+    @classmethod
+    def load(cls, path: str | None = None) -> "SheetCursor":
+        path = path or config["spreadsheet"]["cursor_path"]
+        next_row = config["spreadsheet"]["row_start"]
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                next_row = max(next_row, json.load(f).get(cls._key(), next_row))
+        return cls(path, next_row)
 
-creds = service_account.Credentials.from_service_account_info(
-    json.loads(GOOGLE_SA_KEY), scopes=SCOPES
-)
+    def advance(self, next_row: int):
+        # workers on one host share the file; the lock keeps their read-modify-writes apart
+        self.next_row = max(self.next_row, next_row)
+
+        with file_lock(self.path):
+            data = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            self.next_row = max(self.next_row, data.get(self._key(), self.next_row))
+            data[self._key()] = self.next_row
+            write_atomic(self.path, json.dumps(data))
 
 
 class SheetsService:
     def __init__(self):
         self.spreadsheet_id = config["spreadsheet"]["spreadsheet_id"]
         self.sheet_name = config["spreadsheet"]["sheet_name"]
-        self.service = build("sheets", "v4", credentials=creds)
+        self.service = get_client("sheets", "v4")
+
+        # write-behind buffer of cell updates, flushed with one batchUpdate
+        write_config = config["spreadsheet"]["write_behind"]
+        self.flush_size: int = write_config["flush_size"]
+        self.flush_interval: float = write_config["flush_interval"]
+        self.retry_policy = RetryPolicy(
+            write_config["max_attempts"], write_config["retry_delay"], write_config["max_retry_delay"]
+        )
+        self._pending: list[dict] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_timer: threading.Timer | None = None
 
-    def get_rows(self):
+    @traced("sheet_read")
+    def get_header(self) -> list[str]:
         result = (
             self.service.spreadsheets()
             .values()
-            .get(spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A1:Z")
-            .execute()
+            .get(spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!1:1")
+            .execute(http=authorized_http())
         )
-        data = result.get("values", [])
-        columns = data[0]
-        raw_rows = data[1:]
-        rows = []
-        for row in raw_rows:
-            new_row = row[: len(columns)]
-            if len(new_row) < len(columns):
-                new_row += [""] * (len(columns) - len(new_row))
-            rows.append(new_row)
-        df = pd.DataFrame(rows, columns=columns)
-
-        return df
+        values = result.get("values", [])
+        return values[0] if values else []
 
+    def iter_row_chunks(self, start_row: int, width: int, chunk_size: int | None = None):
+        # Pages through the sheet from start_row, yielding (first_row_index, rows)
+        # with every row padded or cut to `width` cells. Stops at the first short
+        # page, since the API leaves out trailing empty rows.
+        chunk_size = chunk_size or config["spreadsheet"]["fetch_chunk_size"]
+        last_column = column_letter(width)
+        while True:
+            end_row = start_row + chunk_size - 1
+            with Span("sheet_read", start_row=start_row):
+                result = (
+                    self.service.spreadsheets()
+                    .values()
+                    .get(
+                        spreadsheetId=self.spreadsheet_id,
+                        range=f"{self.sheet_name}!A{start_row}:{last_column}{end_row}",
+                    )
+                    .execute(http=authorized_http())
+                )
+            rows = [row[:width] + [""] * (width - len(row)) for row in result.get("values", [])]
+            if rows:
+                yield start_row, rows
+            if len(rows) < chunk_size:
+                return
+            start_row = end_row + 1
+
+    @traced("sheet_read")
+    def get_cells(self, column: str, rows: list[int]) -> dict[int, str]:
+        # current values of one column in the given rows, read with a single batchGet
+        result = (
+            self.service.spreadsheets()
+            .values()
+            .batchGet(
+                spreadsheetId=self.spreadsheet_id,
+                ranges=[f"{self.sheet_name}!{column}{row}" for row in rows],
+            )
+            .execute(http=authorized_http())
+        )
+        cells = {}
+        for row, value_range in zip(rows, result.get("valueRanges", [])):
+            values = value_range.get("values", [])
+            cells[row] = values[0][0] if values and values[0] else ""
+        return cells
+
+    def write_cells(self, column: str, values: dict[int, str]):
+        # writes right away, bypassing the write-behind buffer
+        self._batch_update(
+            [{"range": f"{self.sheet_name}!{column}{row}", "values": [[value]]} for row, value in values.items()]
+        )
+
+    @traced("sheet_write")
     def update_cell(self, row: int, column: str, value):
         write_range = f"{self.sheet_name}!{column}{row}"
         body = {"values": [[value]]}
@@ -51,4 +134,54 @@ class SheetsService:
             range=write_range,
             valueInputOption="RAW",
             body=body,
-        ).execute()
+        ).execute(http=authorized_http())
+
+    def queue_update(self, row: int, column: str, value):
+        # Buffers the write. It is sent once flush_size updates are waiting, or
+        # flush_interval seconds after the first one, or on close().
+        with self._pending_lock:
+            self._pending.append({"range": f"{self.sheet_name}!{column}{row}", "values": [[value]]})
+            n_pending = len(self._pending)
+            if n_pending < self.flush_size and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+        if n_pending >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                updates, self._pending = self._pending, []
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+
+            if not updates:
+                return
+
+            try:
+                self._batch_update(updates)
+            except Exception:
+                # keep the updates so the next flush (or close) tries them again
+                with self._pending_lock:
+                    self._pending = updates + self._pending
+                raise
+
+    @traced("sheet_write")
+    def _batch_update(self, updates: list[dict]):
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            try:
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "RAW", "data": updates},
+                ).execute(http=authorized_http())
+                return
+            except Exception:
+                if attempt == self.retry_policy.max_attempts:
+                    raise
+                time.sleep(self.retry_policy.delay(attempt))
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,47 @@
+from config import config
+from utils import column_index
+
+
+class SheetSchema:
+    # The input sheet's header, classified once per run: which columns hold SPS
+    # and PSE essays (with their prompts) and where each metadata field lives.
+    def __init__(self, header: list[str]):
+        spreadsheet = config["spreadsheet"]
+        sps_indicator = spreadsheet["sps_start_indicator"]
+        pse_indicator = spreadsheet["pse_start_indicator"]
+
+        self.header = header
+        self.sps_columns: list[tuple[int, str]] = [
+            (i, key[len(sps_indicator):]) for i, key in enumerate(header) if key.startswith(sps_indicator)
+        ]
+        self.pse_columns: list[tuple[int, str]] = [
+            (i, key[len(pse_indicator):]) for i, key in enumerate(header) if key.startswith(pse_indicator)
+        ]
+
+        self.completed = column_index(spreadsheet["completed_column"])
+        self.student_email = column_index(spreadsheet["student_email_column"])
+        self.parent_email = column_index(spreadsheet["parent_email_column"])
+        self.reported_gpa = column_index(spreadsheet["reported_gpa_column"])
+        self.middle_school = column_index(spreadsheet["middle_school_column"])
+
+        metadata = [self.completed, self.student_email, self.parent_email, self.reported_gpa, self.middle_school]
+        self.width = max([len(header)] + [i + 1 for i in metadata])
+
+    @property
+    def essay_columns(self) -> list[int]:
+        return [i for i, _ in self.sps_columns + self.pse_columns]
+
+    def pending_rows(self, rows: list[list[str]]) -> list[int]:
+        # Positions of rows that aren't completed and have a student email and at
+        # least one essay, selected with whole-column comparisons. Whitespace-only
+        # essays still pass here; StudentEntry.from_row drops them.
+        if not rows or not self.essay_columns:
+            return []
+
+        import numpy as np
+        import pandas as pd
+
+        df = pd.DataFrame(rows)
+        mask = (df[self.completed] != "TRUE") & (df[self.student_email] != "")
+        mask &= (df[self.essay_columns] != "").any(axis=1)
+        return np.flatnonzero(mask.to_numpy()).tolist()
@@ -0,0 +1,50 @@
+import fcntl
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+def _make_parent(path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+@contextmanager
+def file_lock(path: str):
+    # exclusive lock shared by every process on the host, held on a side file next to `path`
+    _make_parent(path)
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomic(path: str, content: str):
+    # Writes through a temp file of its own in the same directory and renames
+    # it over `path`, so concurrent writers never share a temp file and readers
+    # only ever see a whole file.
+    _make_parent(path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def open_sqlite(path: str, timeout: float = 5.0) -> tuple[sqlite3.Connection, threading.Lock]:
+    # An autocommit WAL connection usable from any thread, and the lock that
+    # serializes its use, since sqlite calls run in worker threads.
+    _make_parent(path)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn, threading.Lock()
@@ -1,14 +1,28 @@
-from time import time
+import functools
+import inspect
+
+from metrics import Span
 
 
 def time_function(func):
     # This function shows the execution time of
-    # the function object passed
+    # the function object passed, sync or async,
+    # and records it as a metrics span
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrap_async(*args, **kwargs):
+            with Span(func.__name__) as span:
+                result = await func(*args, **kwargs)
+            print(f"Function {func.__name__!r} executed in {span.duration:.4f}s")
+            return result
+
+        return wrap_async
+
+    @functools.wraps(func)
     def wrap_func(*args, **kwargs):
-        t1 = time()
-        result = func(*args, **kwargs)
-        t2 = time()
-        print(f"Function {func.__name__!r} executed in {(t2-t1):.4f}s")
+        with Span(func.__name__) as span:
+            result = func(*args, **kwargs)
+        print(f"Function {func.__name__!r} executed in {span.duration:.4f}s")
         return result
 
     return wrap_func
@@ -38,3 +52,23 @@ def float_to_dollar(amount):
     dollars = int(amount)
     cents = int(round((amount - dollars) * 10000))
     return "${}.{:04d}".format(dollars, cents)
+
+
+def column_letter(number: int) -> str:
+    # 1 -> "A", 26 -> "Z", 27 -> "AA"
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def column_index(column: str) -> int:
+    # "A" -> 0, "Z" -> 25, "AA" -> 26
+    if not column.isalpha():
+        raise ValueError(f"Invalid column: {column!r}")
+
+    number = 0
+    for c in column.upper():
+        number = number * 26 + ord(c) - 64
+    return number - 1